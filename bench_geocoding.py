@@ -0,0 +1,237 @@
+import io
+import os
+import sys
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import contextlib
+from cleanup import process_location_frontmatter
+from geocoding import geopy_available
+from nominatim_stub import NominatimStub, load_places, DEFAULT_FIXTURE
+from utils import Colors, print_error
+
+
+def generate_vault(directory, places, notes, unique, unknown_rate, seed):
+    """
+    Write a synthetic geotagged vault of markdown notes.
+
+    Coordinates are drawn from a pool of `unique` points scattered around the
+    fixture places, so notes share coordinates and exercise the location cache.
+    A fraction of the pool lies in the open ocean, where nothing can be geocoded.
+
+    Returns:
+        Number of notes written with coordinates
+    """
+    rng = random.Random(seed)
+    pool = []
+    for _ in range(unique):
+        if rng.random() < unknown_rate:
+            pool.append((rng.uniform(-40, -30), rng.uniform(-140, -120)))
+        else:
+            place = rng.choice(places)
+            pool.append(
+                (
+                    round(float(place["lat"]) + rng.uniform(-0.05, 0.05), 6),
+                    round(float(place["lon"]) + rng.uniform(-0.05, 0.05), 6),
+                )
+            )
+
+    for i in range(notes):
+        notebook = os.path.join(directory, f"Notebook {i % 10}")
+        os.makedirs(notebook, exist_ok=True)
+        latitude, longitude = pool[i] if i < len(pool) else rng.choice(pool)
+        with open(os.path.join(notebook, f"Note {i}.md"), "w", encoding="utf-8") as f:
+            f.write(
+                f"---\ntitle: Note {i}\nlatitude: {latitude}\nlongitude: {longitude}\n"
+                f"altitude: 0\n---\n\nSynthetic note {i}\n"
+            )
+    return notes
+
+
+def run_once(vault, stub, delay, timeout):
+    """Run the location conversion on a vault against the stub and collect statistics."""
+    stub.reset_stats()
+    events = process_location_frontmatter(
+        vault,
+        convert_to_location=True,
+        nominatim_url=stub.url,
+        request_delay=delay,
+        geocode_timeout=timeout,
+    )
+    stats = {}
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        try:
+            while True:
+                next(events)
+        except StopIteration as stop:
+            stats = stop.value or {}
+    stats["elapsed"] = time.perf_counter() - start
+    stats["server"] = dict(stub.stats)
+    return stats
+
+
+def report(title, stats):
+    elapsed = stats["elapsed"]
+    lookups = stats["cache_hits"] + stats["cache_misses"]
+    requests = stats["server"]["requests"]
+    hit_rate = stats["cache_hits"] / lookups * 100 if lookups else 0
+    print(f"\n{Colors.BLUE}{title}{Colors.RESET}")
+    print("=" * 60)
+    print(f"Elapsed: {elapsed:.2f}s")
+    print(f"Notes with coordinates: {stats['files_with_coordinates']}")
+    print(f"Notes/sec: {stats['files_with_coordinates'] / elapsed:.1f}")
+    print(f"Lookups/sec (including cache hits): {lookups / elapsed:.1f}")
+    print(f"HTTP requests/sec: {requests / elapsed:.1f}")
+    print(f"Locations added: {stats['locations_added']}")
+    print(f"Failed geocoding: {stats['failed_geocoding']}")
+    print("\nCache:")
+    print(f"  - Hits: {stats['cache_hits']}")
+    print(f"  - Misses: {stats['cache_misses']}")
+    print(f"  - Hit rate: {hit_rate:.1f}%")
+    print("\nServer:")
+    for key, value in stats["server"].items():
+        print(f"  - {key.replace('_', ' ').capitalize()}: {value}")
+    print(f"  - Retried requests: {max(0, requests - stats['cache_misses'])}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark --convert-location against a local Nominatim stand-in.",
+    )
+    parser.add_argument(
+        "--notes",
+        type=int,
+        default=500,
+        help="Number of synthetic notes (default: 500)",
+    )
+    parser.add_argument(
+        "--unique",
+        type=int,
+        default=100,
+        help="Number of distinct coordinates (default: 100)",
+    )
+    parser.add_argument(
+        "--unknown-rate",
+        type=float,
+        default=0.1,
+        help="Fraction of coordinates that cannot be geocoded (default: 0.1)",
+    )
+    parser.add_argument(
+        "--fixture", default=DEFAULT_FIXTURE, help="JSON dataset of places to serve"
+    )
+    parser.add_argument(
+        "--latency",
+        type=float,
+        default=0.005,
+        help="Server latency per request in seconds (default: 0.005)",
+    )
+    parser.add_argument(
+        "--jitter",
+        type=float,
+        default=0.0,
+        help="Random extra server latency in seconds",
+    )
+    parser.add_argument(
+        "--error-rate",
+        type=float,
+        default=0.0,
+        help="Fraction of requests answered with HTTP 500",
+    )
+    parser.add_argument(
+        "--hang-rate",
+        type=float,
+        default=0.0,
+        help="Fraction of requests held until the client times out",
+    )
+    parser.add_argument(
+        "--rate-limit",
+        type=int,
+        default=0,
+        help="Server requests per second before HTTP 429 (default: unlimited)",
+    )
+    parser.add_argument(
+        "--delay",
+        type=float,
+        default=0.0,
+        help="Client delay between requests in seconds (default: 0)",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=0.5,
+        help="Client timeout in seconds (default: 0.5)",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=1,
+        help="Seed for the vault and error injection (default: 1)",
+    )
+    args = parser.parse_args()
+
+    if not geopy_available():
+        print_error("geopy library not installed. Install with: pip install geopy")
+        return 1
+
+    places = load_places(args.fixture)
+    faults = args.error_rate or args.hang_rate or args.rate_limit
+    workdir = tempfile.mkdtemp(prefix="joplin-geocoding-bench-")
+    try:
+        template = os.path.join(workdir, "template")
+        generate_vault(
+            template, places, args.notes, args.unique, args.unknown_rate, args.seed
+        )
+        print(
+            f"Generated {args.notes} notes with {args.unique} distinct coordinates in {template}"
+        )
+
+        runs = [("Clean run", dict(error_rate=0, hang_rate=0, rate_limit=0))]
+        if faults:
+            runs.append(
+                (
+                    "Run with injected faults",
+                    dict(
+                        error_rate=args.error_rate,
+                        hang_rate=args.hang_rate,
+                        rate_limit=args.rate_limit,
+                    ),
+                )
+            )
+
+        results = []
+        for title, options in runs:
+            vault = os.path.join(workdir, "vault")
+            shutil.rmtree(vault, ignore_errors=True)
+            shutil.copytree(template, vault)
+            with NominatimStub(
+                places,
+                latency=args.latency,
+                jitter=args.jitter,
+                hang_seconds=args.timeout * 2,
+                seed=args.seed,
+                **options,
+            ) as stub:
+                stats = run_once(vault, stub, args.delay, args.timeout)
+            report(title, stats)
+            results.append(stats)
+
+        if len(results) == 2:
+            overhead = results[1]["elapsed"] - results[0]["elapsed"]
+            print(f"\n{Colors.YELLOW}Fault handling overhead:{Colors.RESET}")
+            print(
+                f"  - {overhead:.2f}s ({overhead / results[0]['elapsed'] * 100:.0f}% slower than the clean run)"
+            )
+            print(
+                f"  - {results[1]['failed_geocoding'] - results[0]['failed_geocoding']} additional failed lookups"
+            )
+        print("=" * 60)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
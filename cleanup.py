@@ -1,33 +1,61 @@
 import os
 import re
-import time
+from crawler import walk
+from events import Event, RENAMED, REWRITTEN, REMOVED, ERROR
+from geocoding import geopy_available, create_geolocator, get_location_name
 from utils import print_status, print_error
 
-# Try to import geopy for reverse geocoding
-try:
-    from geopy.geocoders import Nominatim
-    from geopy.exc import GeocoderTimedOut, GeocoderServiceError
+STEP_FRONTMATTER = "process_location_frontmatter"
 
-    GEOPY_AVAILABLE = True
-except ImportError:
-    GEOPY_AVAILABLE = False
 
+def _dir_filter(recursive, scope=None):
+    """Return the crawler dir_filter for the recursive and scope arguments of a step."""
+    if not recursive:
+        return lambda path, entry: False
+    return scope.dir_filter if scope is not None else None
 
-def remove_trailing_underscores(directory):
-    """Remove trailing underscores and spaces from all files and folders in the directory tree."""
+
+def remove_trailing_underscores(directory, workers=None, recursive=True, scope=None):
+    """
+    Remove trailing underscores and spaces from all files and folders in the directory tree.
+
+    With recursive=False, only the direct children of the directory are renamed. With a
+    scope.Scope, only the files and folders it selects are renamed; if it has a
+    changed_since time, folders are only renamed if a file inside them is selected.
+
+    Yields:
+        Event for every file or folder renamed
+    """
+    by_time = scope is not None and scope.changed_since is not None
+    # Directories holding a selected file, by their path before renaming
+    selected_dirs = set()
 
     # Process files and directories from deepest to shallowest to avoid path conflicts
-    for root, dirs, files in os.walk(directory, topdown=False):
+    for root, dirs, files in walk(
+        directory,
+        topdown=False,
+        workers=workers,
+        dir_filter=_dir_filter(recursive, scope),
+    ):
         # Rename files first
         for file in files:
             # Split filename and extension
             name, ext = os.path.splitext(file)
+            old_path = os.path.join(root, file)
+            selected = None
+            if by_time:
+                selected = scope.selects(old_path)
+                if selected:
+                    selected_dirs.add(root)
 
             # Check if the name part ends with underscores or spaces and has other characters
             if (name.endswith("_") or name.endswith(" ")) and not re.match(
                 r"^[_ ]+$", name
             ):
-                old_path = os.path.join(root, file)
+                if selected is None and scope is not None:
+                    selected = scope.selects(old_path)
+                if selected is False:
+                    continue
                 new_name = name.rstrip("_ ") + ext
                 new_path = os.path.join(root, new_name)
 
@@ -41,13 +69,21 @@ def remove_trailing_underscores(directory):
 
                 print_status(f"Renaming file: {old_path} -> {new_path}")
                 os.rename(old_path, new_path)
+                yield Event(RENAMED, "remove_trailing_underscores", new_path, old_path)
 
         # Rename directories
         for dir_name in dirs:
+            old_path = os.path.join(root, dir_name)
+            if by_time:
+                if old_path not in selected_dirs:
+                    continue
+                selected_dirs.discard(old_path)
+                selected_dirs.add(root)
             if (dir_name.endswith("_") or dir_name.endswith(" ")) and not re.match(
                 r"^[_ ]+$", dir_name
             ):
-                old_path = os.path.join(root, dir_name)
+                if scope is not None and not scope.contains(old_path):
+                    continue
                 new_name = dir_name.rstrip("_ ")
                 new_path = os.path.join(root, new_name)
 
@@ -60,23 +96,34 @@ def remove_trailing_underscores(directory):
 
                 print_status(f"Renaming directory: {old_path} -> {new_path}")
                 os.rename(old_path, new_path)
+                yield Event(RENAMED, "remove_trailing_underscores", new_path, old_path)
 
 
-def remove_empty_resources_dirs(directory):
-    """Remove empty '_resources' directories recursively."""
-    removed_dirs = []
+def remove_empty_resources_dirs(directory, workers=None, scope=None):
+    """
+    Remove empty '_resources' directories recursively.
+
+    With a scope.Scope, only the directories it selects are removed.
+
+    Yields:
+        Event for every directory removed and error encountered
+    """
 
     # Walk from deepest to shallowest to handle nested empty directories
-    for root, dirs, files in os.walk(directory, topdown=False):
+    for root, dirs, files in walk(
+        directory, topdown=False, workers=workers, dir_filter=_dir_filter(True, scope)
+    ):
         for dir_name in dirs:
             if dir_name == "_resources":
                 dir_path = os.path.join(root, dir_name)
+                if scope is not None and not scope.contains(dir_path):
+                    continue
                 try:
                     # Check if directory is empty
                     if not os.listdir(dir_path):
                         print_status(f"Removing empty _resources directory: {dir_path}")
                         os.rmdir(dir_path)
-                        removed_dirs.append(dir_path)
+                        yield Event(REMOVED, "remove_empty_resources_dirs", dir_path)
                     else:
                         print_status(
                             f"_resources directory not empty, skipping: {dir_path}"
@@ -86,140 +133,9 @@ def remove_empty_resources_dirs(directory):
                         print_status(f"  Contents: {contents}")
                 except OSError as e:
                     print_error(f"Error checking/removing directory {dir_path}: {e}")
-
-    return removed_dirs
-
-
-def get_location_name(
-    latitude, longitude, geolocator=None, cache=None, max_retries=3, debug=False
-):
-    """
-    Convert latitude and longitude to a human-readable location name.
-    Returns the most specific location available (city, town, village, or region).
-    Uses caching to avoid redundant API calls for the same coordinates.
-
-    Args:
-        latitude: Latitude coordinate
-        longitude: Longitude coordinate
-        geolocator: Optional pre-initialized Nominatim geolocator instance
-        cache: Optional dictionary to cache results (coordinates tuple -> location name)
-        max_retries: Number of retry attempts for timeouts (default: 3)
-        debug: If True, print debug messages for API requests (default: False)
-
-    Returns:
-        String with location name (e.g., "New York, New York, United States") or None if failed
-    """
-    if not GEOPY_AVAILABLE:
-        return None
-
-    # Round coordinates to reduce cache misses from minor differences
-    # 5 decimal places = ~1.1 meter precision, good enough for city-level lookup
-    coord_key = (round(latitude, 5), round(longitude, 5))
-
-    # Check cache first
-    if cache is not None and coord_key in cache:
-        if debug:
-            cached_value = cache[coord_key]
-            if cached_value:
-                print_status(
-                    f"[DEBUG] Cache HIT for ({latitude}, {longitude}) -> {cached_value}"
-                )
-            else:
-                print_status(
-                    f"[DEBUG] Cache HIT for ({latitude}, {longitude}) -> (no location found)"
-                )
-        return cache[coord_key]
-
-    try:
-        # Use provided geolocator or create new one
-        if geolocator is None:
-            geolocator = Nominatim(user_agent="joplin-to-obsidian-converter")
-
-        # Retry logic for handling timeouts
-        for attempt in range(max_retries):
-            try:
-                # Respect Nominatim's usage policy: max 1 request per second
-                time.sleep(1)
-
-                if debug:
-                    print_status(
-                        f"[DEBUG] Making API request for ({latitude}, {longitude}) - Attempt {attempt + 1}/{max_retries}"
-                    )
-
-                location = geolocator.reverse(
-                    f"{latitude}, {longitude}", language="en", timeout=10
-                )
-
-                if debug:
-                    if location:
-                        print_status(
-                            f"[DEBUG] API response received for ({latitude}, {longitude})"
-                        )
-                    else:
-                        print_status(
-                            f"[DEBUG] API returned no location for ({latitude}, {longitude})"
-                        )
-
-                if location and location.raw.get("address"):
-                    address = location.raw["address"]
-
-                    # Try to get the most specific location in order of preference
-                    location_parts = []
-
-                    # City, town, or village
-                    if "city" in address:
-                        location_parts.append(address["city"])
-                    elif "town" in address:
-                        location_parts.append(address["town"])
-                    elif "village" in address:
-                        location_parts.append(address["village"])
-                    elif "hamlet" in address:
-                        location_parts.append(address["hamlet"])
-                    elif "municipality" in address:
-                        location_parts.append(address["municipality"])
-
-                    # State/Region
-                    if "state" in address:
-                        location_parts.append(address["state"])
-                    elif "region" in address:
-                        location_parts.append(address["region"])
-
-                    # Country
-                    if "country" in address:
-                        location_parts.append(address["country"])
-
-                    if location_parts:
-                        result = ", ".join(location_parts)
-                        # Cache the successful result
-                        if cache is not None:
-                            cache[coord_key] = result
-                        return result
-
-                # Cache the None result to avoid retrying failed lookups
-                if cache is not None:
-                    cache[coord_key] = None
-                return None
-
-            except GeocoderTimedOut:
-                if attempt < max_retries - 1:
-                    print_status(
-                        f"Geocoding timeout for ({latitude}, {longitude}), retrying... (attempt {attempt + 2}/{max_retries})"
-                    )
-                    time.sleep(2)  # Wait a bit longer before retry
-                else:
-                    print_error(
-                        f"Geocoding timeout for ({latitude}, {longitude}) after {max_retries} attempts"
+                    yield Event(
+                        ERROR, "remove_empty_resources_dirs", dir_path, None, str(e)
                     )
-                    return None
-            except GeocoderServiceError as e:
-                print_error(
-                    f"Geocoding service error for ({latitude}, {longitude}): {e}"
-                )
-                return None
-
-    except Exception as e:
-        print_error(f"Error during geocoding: {e}")
-        return None
 
 
 def process_location_frontmatter(
@@ -228,6 +144,16 @@ def process_location_frontmatter(
     strip_coordinates=False,
     add_source=False,
     debug=False,
+    state=None,
+    workers=None,
+    transforms=(),
+    nominatim_url=None,
+    request_delay=1.0,
+    geocode_timeout=10,
+    recursive=True,
+    location_cache=None,
+    geolocator=None,
+    scope=None,
 ):
     """
     Process latitude, longitude, and altitude attributes in YAML front matter.
@@ -240,24 +166,44 @@ def process_location_frontmatter(
                           Cannot be used together with convert_to_location.
         add_source: If True, add 'source: Joplin' field to front matter if not already present.
         debug: If True, print debug messages for API requests and caching (default: False)
+        state: Optional SyncState; notes unchanged since the last run are skipped
+        workers: Number of concurrent directory listings (default: crawler.DEFAULT_WORKERS)
+        transforms: Additional (name, callable) front matter transforms, applied after the
+                    built-in ones. Each callable takes (front_matter, file_path) and returns
+                    the new front matter.
+        nominatim_url: Optional base URL of the Nominatim service used by convert_to_location
+        request_delay: Seconds to wait between geocoding requests (default: 1.0, the
+                       public Nominatim usage policy)
+        geocode_timeout: Seconds to wait for a geocoding response (default: 10)
+        recursive: If False, only process markdown files directly in the directory
+        location_cache: Optional dictionary of coordinates -> location name, shared
+                        between calls to keep lookups warm (default: a new cache)
+        geolocator: Optional pre-initialized geolocator for nominatim_url
+        scope: Optional scope.Scope; only the notes it selects are processed
+
+    Yields:
+        Event for every file rewritten and error encountered, including coordinates
+        that could not be geocoded
 
     Returns:
-        List of file paths that were processed/modified
+        Statistics dictionary (the value of the generator's StopIteration), including
+        cache_hits and cache_misses for location lookups
     """
     if convert_to_location and strip_coordinates:
-        print_error("convert_to_location and strip_coordinates cannot both be True")
-        return []
+        message = "convert_to_location and strip_coordinates cannot both be True"
+        print_error(message)
+        yield Event(ERROR, STEP_FRONTMATTER, directory, None, message)
+        return
 
-    if convert_to_location and not GEOPY_AVAILABLE:
+    if convert_to_location and not geopy_available():
         print_error("geopy library not installed. Install with: pip install geopy")
         print("Cannot convert location data without geopy")
-        return []
-
-    processed_files = []
+        yield Event(ERROR, STEP_FRONTMATTER, directory, None, "geopy not installed")
+        return
 
     # Initialize geocoder and cache once if we're converting locations
-    geolocator = None
-    location_cache = {}
+    if location_cache is None:
+        location_cache = {}
     cache_hits = 0
     cache_misses = 0
 
@@ -271,17 +217,35 @@ def process_location_frontmatter(
         "source_added": 0,
         "api_requests": 0,
         "failed_geocoding": 0,
+        "unchanged_skipped": 0,
     }
+    transform_counts = {name: 0 for name, _ in transforms}
 
     if convert_to_location:
-        geolocator = Nominatim(user_agent="joplin-to-obsidian-converter")
+        if request_delay > 0:
+            print(
+                f"Note: This may take a while due to API rate limits (1 request/{request_delay:g} seconds)"
+            )
+        if debug:
+            print_status(
+                "[DEBUG] Debug mode enabled - detailed API request logging active"
+            )
+        if geolocator is None:
+            geolocator = create_geolocator(nominatim_url)
         print_status("Initializing location cache for coordinate lookups")
 
-    for root, dirs, files in os.walk(directory):
+    for root, dirs, files in walk(
+        directory, workers=workers, dir_filter=_dir_filter(recursive, scope)
+    ):
         for file in files:
             if file.lower().endswith((".md", ".markdown")):
-                stats["total_markdown_files"] += 1
                 file_path = os.path.join(root, file)
+                if scope is not None and not scope.selects(file_path):
+                    continue
+                stats["total_markdown_files"] += 1
+                if state is not None and not state.is_changed(file_path):
+                    stats["unchanged_skipped"] += 1
+                    continue
                 try:
                     with open(file_path, "r", encoding="utf-8") as f:
                         content = f.read()
@@ -300,6 +264,7 @@ def process_location_frontmatter(
                             # Extract latitude and longitude if we need to convert
                             latitude = None
                             longitude = None
+                            failed_geocoding = False
 
                             if convert_to_location:
                                 lat_match = re.search(
@@ -332,6 +297,8 @@ def process_location_frontmatter(
                                         geolocator,
                                         location_cache,
                                         debug=debug,
+                                        delay=request_delay,
+                                        timeout=geocode_timeout,
                                     )
 
                                     # Track cache statistics
@@ -369,6 +336,7 @@ def process_location_frontmatter(
                                         print_status(
                                             f"Could not geocode coordinates in {file_path}"
                                         )
+                                        failed_geocoding = True
 
                             # Strip coordinates if requested (and not converting)
                             if strip_coordinates and not convert_to_location:
@@ -417,6 +385,13 @@ def process_location_frontmatter(
                                         front_matter += "\nsource: Joplin\n"
                                     stats["source_added"] += 1
 
+                            # Apply additional transforms from the step registry
+                            for name, transform in transforms:
+                                transformed = transform(front_matter, file_path)
+                                if transformed != front_matter:
+                                    transform_counts[name] += 1
+                                    front_matter = transformed
+
                             # Clean up multiple consecutive newlines
                             front_matter = re.sub(r"\n\n+", "\n\n", front_matter)
                             front_matter = front_matter.strip()
@@ -444,10 +419,21 @@ def process_location_frontmatter(
                                     print_status(
                                         f"Removed location data from: {file_path}"
                                     )
-                                processed_files.append(file_path)
+                                yield Event(REWRITTEN, STEP_FRONTMATTER, file_path)
+
+                            # Reported after the rewrite, so incremental runs retry the lookup
+                            if failed_geocoding:
+                                yield Event(
+                                    ERROR,
+                                    STEP_FRONTMATTER,
+                                    file_path,
+                                    None,
+                                    "Could not geocode coordinates",
+                                )
 
                 except Exception as e:
                     print_error(f"Error processing file {file_path}: {e}")
+                    yield Event(ERROR, STEP_FRONTMATTER, file_path, None, str(e))
 
     # Print statistics summary (using print instead of print_status to avoid overwriting)
     print("\n")  # Clear the current line and add newline
@@ -457,6 +443,8 @@ def process_location_frontmatter(
     print(f"Total markdown files found: {stats['total_markdown_files']}")
     print(f"Files with coordinates: {stats['files_with_coordinates']}")
     print(f"Files modified: {stats['files_processed']}")
+    if state is not None:
+        print(f"Unchanged notes skipped: {stats['unchanged_skipped']}")
 
     if convert_to_location:
         print("\nLocation Conversion:")
@@ -481,6 +469,13 @@ def process_location_frontmatter(
         print("\nSource Field:")
         print(f"  - Files with source added: {stats['source_added']}")
 
+    if transforms:
+        print("\nAdditional Transforms:")
+        for name, count in transform_counts.items():
+            print(f"  - {name}: {count} files changed")
+
     print("=" * 60)
 
-    return processed_files
+    stats["cache_hits"] = cache_hits
+    stats["cache_misses"] = cache_misses
+    return stats
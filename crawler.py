@@ -0,0 +1,284 @@
+import os
+import heapq
+import threading
+
+# Default number of concurrent directory listings
+DEFAULT_WORKERS = min(32, (os.cpu_count() or 1) + 4)
+
+# Listings each worker may produce ahead of the consumer before it waits
+LOOKAHEAD_PER_WORKER = 8
+
+
+class _Crawl:
+    """
+    Pool of os.scandir workers listing a directory tree concurrently.
+
+    Directories waiting to be listed are kept in a heap ordered by their position in
+    the walk, so workers always list the directories the consumer needs next and
+    deep notebook hierarchies keep all workers busy.
+
+    Listings are kept until the consumer asks for them with wait(). Each listing
+    carries the set of subdirectories the workers descended into, so the consumer
+    never waits for a directory that was not scheduled. Once lookahead listings are
+    waiting, workers only list the directory the consumer is blocked on, so memory
+    stays bounded however large the tree is.
+    """
+
+    def __init__(self, top, workers, followlinks=False, dir_filter=None, stat=False):
+        self.top = top
+        self.followlinks = followlinks
+        self.dir_filter = dir_filter
+        self.stat = stat
+        self.workers = workers
+        self.lookahead = max(workers, 1) * LOOKAHEAD_PER_WORKER
+        self._results = {}
+        self._queue = []
+        self._cond = threading.Condition()
+        self._pending = 0
+        self._wanted = None
+        self._pruned = set()
+        self._closed = False
+        self._error = None
+        self._threads = []
+
+        if workers > 1:
+            # Entries are (walk position, path); positions are tuples of child indexes
+            self._queue.append(((), top))
+            self._pending = 1
+            for _ in range(workers):
+                thread = threading.Thread(target=self._worker, daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def should_descend(self, path, entry):
+        """Return True if the walk continues into the given directory entry."""
+        if not self.followlinks:
+            try:
+                if entry.is_symlink():
+                    return False
+            except OSError:
+                return False
+        if self.dir_filter is not None and not self.dir_filter(path, entry):
+            return False
+        return True
+
+    def scan(self, path):
+        """
+        List a directory.
+
+        Returns:
+            Tuple of (dir_entries, file_entries, children) where children is the set
+            of subdirectory paths to descend into, or None if listing failed
+        """
+        dirs = []
+        files = []
+        try:
+            with os.scandir(path) as it:
+                for entry in it:
+                    try:
+                        is_dir = entry.is_dir()
+                    except OSError:
+                        is_dir = False
+                    if is_dir:
+                        dirs.append(entry)
+                    else:
+                        if self.stat:
+                            # Fill the DirEntry stat cache while still on the worker thread
+                            try:
+                                entry.stat()
+                            except OSError:
+                                pass
+                        files.append(entry)
+        except OSError:
+            return None
+        children = set()
+        for entry in dirs:
+            child = os.path.join(path, entry.name)
+            if self.should_descend(child, entry):
+                children.add(child)
+        return dirs, files, children
+
+    def _take(self):
+        if not self._queue:
+            return None
+        if len(self._results) >= self.lookahead and self._queue[0][1] != self._wanted:
+            # Only the directory the consumer is blocked on may still be listed
+            return None
+        return heapq.heappop(self._queue)
+
+    def _is_pruned(self, path):
+        while len(path) > len(self.top):
+            if path in self._pruned:
+                return True
+            path = os.path.dirname(path)
+        return False
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                if self._closed:
+                    return
+                item = self._take()
+                while item is None:
+                    if self._closed or self._pending == 0:
+                        return
+                    self._cond.wait()
+                    item = self._take()
+            position, path = item
+
+            try:
+                listing = self.scan(path)
+            except BaseException as e:
+                # Surface errors from dir_filter on the consumer thread
+                listing = None
+                with self._cond:
+                    self._error = e
+
+            with self._cond:
+                if self._closed or (self._pruned and self._is_pruned(path)):
+                    # Abandoned while listing: drop it and its subdirectories
+                    listing = None
+                else:
+                    self._results[path] = listing
+                if listing is not None:
+                    for index, entry in enumerate(listing[0]):
+                        child = os.path.join(path, entry.name)
+                        if child in listing[2]:
+                            heapq.heappush(self._queue, (position + (index,), child))
+                            self._pending += 1
+                self._pending -= 1
+                self._cond.notify_all()
+
+    def wait(self, path):
+        """Return the listing of a directory, blocking until a worker has produced it."""
+        if not self._threads:
+            return self.scan(path)
+        with self._cond:
+            while path not in self._results and self._error is None:
+                self._wanted = path
+                self._cond.notify_all()
+                self._cond.wait()
+            self._wanted = None
+            if self._error is not None:
+                raise self._error
+            # A slot in the lookahead is free again
+            self._cond.notify_all()
+            return self._results.pop(path)
+
+    def prune(self, paths):
+        """Stop listing the given directories and everything below them."""
+        if not self._threads or not paths:
+            return
+        with self._cond:
+            self._pruned.update(paths)
+            prefixes = tuple(path + os.sep for path in paths)
+            kept = [
+                item
+                for item in self._queue
+                if item[1] not in self._pruned and not item[1].startswith(prefixes)
+            ]
+            self._pending -= len(self._queue) - len(kept)
+            heapq.heapify(kept)
+            self._queue = kept
+            for path in list(self._results):
+                if path in self._pruned or path.startswith(prefixes):
+                    del self._results[path]
+            self._cond.notify_all()
+
+    def close(self):
+        """Stop the workers; directories not listed yet are never listed."""
+        with self._cond:
+            self._closed = True
+            self._queue.clear()
+            self._results.clear()
+            self._cond.notify_all()
+
+
+def scandir_walk(
+    top,
+    topdown=True,
+    workers=None,
+    followlinks=False,
+    dir_filter=None,
+    stat=False,
+):
+    """
+    Walk a directory tree like os.walk, listing directories concurrently.
+
+    Directories are listed ahead of time by a pool of os.scandir workers, but
+    results are yielded in exactly the order os.walk would yield them, including
+    the bottom-up guarantee that a directory comes after all of its subdirectories.
+    Workers stay at most a bounded number of listings ahead of the consumer, and
+    closing the generator stops them.
+
+    Args:
+        top: Root directory of the walk
+        topdown: If False, yield each directory after its subdirectories (default: True)
+        workers: Number of concurrent directory listings (default: DEFAULT_WORKERS);
+                 1 or less lists directories sequentially on the calling thread
+        followlinks: If True, descend into symlinked directories (default: False)
+        dir_filter: Optional callable (path, entry) -> bool; directories for which it
+                    returns False are pruned before they are ever listed
+        stat: If True, prefetch stat data for file entries on the worker threads
+
+    Yields:
+        Tuples of (dirpath, dir_entries, file_entries) with os.DirEntry objects.
+        In top-down mode, removing entries from dir_entries prunes the walk: the
+        removed subtrees are no longer listed, apart from listings the workers
+        already produced ahead of the consumer, which are discarded.
+    """
+    if workers is None:
+        workers = DEFAULT_WORKERS
+    top = os.fspath(top)
+    crawl = _Crawl(top, workers, followlinks, dir_filter, stat)
+    try:
+        stack = [(top, None)]
+        while stack:
+            path, listing = stack.pop()
+            if listing is not None:
+                # Bottom-up: all subdirectories have been yielded already
+                yield path, listing[0], listing[1]
+                continue
+
+            listing = crawl.wait(path)
+            if listing is None:
+                continue
+            dirs, files, children = listing
+
+            if topdown:
+                count = len(dirs)
+                yield path, dirs, files
+                if len(dirs) != count:
+                    kept = {os.path.join(path, entry.name) for entry in dirs}
+                    crawl.prune(children - kept)
+            else:
+                stack.append((path, listing))
+
+            for entry in reversed(dirs):
+                child = os.path.join(path, entry.name)
+                if child in children:
+                    stack.append((child, None))
+    finally:
+        crawl.close()
+
+
+def walk(top, topdown=True, workers=None, followlinks=False, dir_filter=None):
+    """
+    Drop-in replacement for os.walk backed by scandir_walk.
+
+    Yields (dirpath, dirnames, filenames) tuples. In top-down mode, removing names
+    from dirnames prunes the walk, as with os.walk; see scandir_walk for listings
+    already made ahead of the consumer.
+    """
+    for root, dir_entries, file_entries in scandir_walk(
+        top,
+        topdown=topdown,
+        workers=workers,
+        followlinks=followlinks,
+        dir_filter=dir_filter,
+    ):
+        dirs = [entry.name for entry in dir_entries]
+        yield root, dirs, [entry.name for entry in file_entries]
+        if topdown and len(dirs) != len(dir_entries):
+            kept = set(dirs)
+            dir_entries[:] = [entry for entry in dir_entries if entry.name in kept]
@@ -0,0 +1,671 @@
+import io
+import os
+import sys
+import json
+import time
+import queue
+import signal
+import argparse
+import threading
+import socketserver
+from collections import Counter, OrderedDict
+from urllib.parse import urlsplit
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from crawler import DEFAULT_WORKERS
+from events import EventLog
+from geocoding import geopy_available, create_geolocator, LocationCache
+from main import run_steps
+from registry import selected_transforms, state_options
+from scope import parse_timestamp, scope_from_args
+from utils import print_error
+
+# Job options and their defaults, named like main.py's command line options
+JOB_OPTIONS = {
+    "dir": None,
+    "strip_location": False,
+    "convert_location": False,
+    "nominatim_url": None,
+    "geocode_delay": 1.0,
+    "debug": False,
+    "add_source": False,
+    "transform": [],
+    "incremental": False,
+    "state_db": None,
+    "events": None,
+    "include": [],
+    "exclude": [],
+    "changed_since": None,
+}
+
+# Job options naming files or directories the job reads or writes
+PATH_OPTIONS = ("dir", "events", "state_db")
+
+# Job states
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+
+def _option_type_error(key, value):
+    """Return why a job option does not have the type of its default, or None."""
+    default = JOB_OPTIONS[key]
+    if isinstance(default, bool):
+        if not isinstance(value, bool):
+            return f"Option {key} must be true or false"
+    elif isinstance(default, float):
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            return f"Option {key} must be a number"
+    elif isinstance(default, list):
+        if not isinstance(value, list) or not all(
+            isinstance(item, str) for item in value
+        ):
+            return f"Option {key} must be a list of strings"
+    elif key == "changed_since":
+        # Like --changed-since, seconds since the epoch are accepted too
+        if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+            return f"Option {key} must be a string or a number"
+    elif value is not None and not isinstance(value, str):
+        return f"Option {key} must be a string"
+    return None
+
+
+class JobError(Exception):
+    """Raised when a submitted job is invalid or cannot be queued."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+class _ThreadOutput(io.TextIOBase):
+    """sys.stdout replacement sending each job thread's output to that job's log."""
+
+    def __init__(self, default):
+        self.default = default
+        self.local = threading.local()
+
+    def _stream(self):
+        return getattr(self.local, "stream", None) or self.default
+
+    def write(self, text):
+        return self._stream().write(text)
+
+    def flush(self):
+        self._stream().flush()
+
+
+class Job:
+    """A migration job and its status and metrics."""
+
+    def __init__(self, job_id, options):
+        self.id = job_id
+        self.options = options
+        self.status = QUEUED
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.steps = []
+        self.geocoding = None
+        self.error = None
+
+    def to_dict(self):
+        counts = Counter()
+        for step in self.steps:
+            counts.update(step["counts"])
+        now = time.time()
+        return {
+            "id": self.id,
+            "status": self.status,
+            "options": self.options,
+            "submitted": self.submitted,
+            "started": self.started,
+            "finished": self.finished,
+            "queue_seconds": (self.started or now) - self.submitted,
+            "run_seconds": (
+                (self.finished or now) - self.started if self.started else None
+            ),
+            "steps": self.steps,
+            "counts": dict(counts),
+            "geocoding": self.geocoding,
+            "error": self.error,
+        }
+
+
+class MigrationDaemon:
+    """
+    Long-running migration service accepting jobs over HTTP.
+
+    Jobs are queued in a bounded queue and run by a fixed set of runner threads.
+    The geopy import, geolocators and location caches (one per Nominatim URL) are
+    kept for the lifetime of the daemon, so later jobs start warm. Jobs whose
+    directory overlaps a queued or running job's are refused.
+
+    Args:
+        host: Interface to listen on (default: 127.0.0.1)
+        port: Port to listen on; 0 picks a free port (default: 8765)
+        socket_path: Listen on this Unix socket instead of a TCP port
+        queue_size: Maximum number of queued jobs before submissions are refused
+                    (default: 16)
+        concurrency: Number of jobs run at the same time (default: 1)
+        workers: Number of concurrent directory listings per job
+                 (default: crawler.DEFAULT_WORKERS)
+        log_dir: Directory for each job's output; discarded if None (default: None)
+        history: Number of finished jobs kept for status queries (default: 1000)
+        allowed_roots: Optional list of directories; jobs naming a directory or file
+                       outside all of them are refused (default: no restriction)
+        cache_size: Maximum number of locations cached per Nominatim URL
+                    (default: 100000)
+    """
+
+    def __init__(
+        self,
+        host="127.0.0.1",
+        port=8765,
+        socket_path=None,
+        queue_size=16,
+        concurrency=1,
+        workers=DEFAULT_WORKERS,
+        log_dir=None,
+        history=1000,
+        allowed_roots=None,
+        cache_size=100000,
+    ):
+        self.concurrency = concurrency
+        self.allowed_roots = [os.path.realpath(root) for root in allowed_roots or []]
+        self.cache_size = cache_size
+        self.workers = workers
+        self.log_dir = log_dir
+        self.history = history
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.jobs = OrderedDict()
+        self.lock = threading.Lock()
+        self.next_id = 1
+        self.started = time.time()
+        self.closing = False
+        self.geolocators = {}
+        self.location_caches = {}
+        self.runners = []
+        self.socket_path = socket_path
+        if socket_path:
+            if os.path.exists(socket_path):
+                os.remove(socket_path)
+            # Only the daemon's user may connect, from the moment the socket exists
+            umask = os.umask(0o177)
+            try:
+                self.server = _UnixHTTPServer(socket_path, self._handler_class())
+            finally:
+                os.umask(umask)
+        else:
+            self.server = ThreadingHTTPServer((host, port), self._handler_class())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        if self.socket_path:
+            return f"unix:{self.socket_path}"
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def warm(self):
+        """Import geopy and create the default geolocator before the first job needs it."""
+        if geopy_available():
+            self._geolocator(None)
+
+    def start(self, serve=True):
+        """Start the job runners and, unless serve is False, serve requests on a background thread."""
+        if not isinstance(sys.stdout, _ThreadOutput):
+            sys.stdout = _ThreadOutput(sys.stdout)
+        if self.log_dir:
+            os.makedirs(self.log_dir, exist_ok=True)
+        for index in range(self.concurrency):
+            runner = threading.Thread(target=self._runner, daemon=True)
+            runner.start()
+            self.runners.append(runner)
+        if serve:
+            self.thread = threading.Thread(
+                target=self.server.serve_forever, daemon=True
+            )
+            self.thread.start()
+        return self
+
+    def stop(self):
+        """Stop accepting jobs, cancel queued ones and wait for running jobs to finish."""
+        self.closing = True
+        if self.thread is not None:
+            self.server.shutdown()
+        self.server.server_close()
+        if self.socket_path and os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        while True:
+            try:
+                job = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            job.status = CANCELLED
+            job.finished = time.time()
+        for _ in self.runners:
+            self.queue.put(None)
+        for runner in self.runners:
+            runner.join()
+        self.runners = []
+        if isinstance(sys.stdout, _ThreadOutput):
+            sys.stdout = sys.stdout.default
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def submit(self, options):
+        """
+        Validate and queue a job.
+
+        Args:
+            options: Dictionary of JOB_OPTIONS; "dir" is required
+
+        Returns:
+            The queued Job
+
+        Raises:
+            JobError: If the options are invalid or the queue is full
+        """
+        if self.closing:
+            raise JobError("Daemon is shutting down", 503)
+        if not isinstance(options, dict):
+            raise JobError("Job must be a JSON object")
+        unknown = sorted(set(options) - set(JOB_OPTIONS))
+        if unknown:
+            raise JobError(f"Unknown options: {', '.join(unknown)}")
+        for key, value in options.items():
+            error = _option_type_error(key, value)
+            if error is not None:
+                raise JobError(error)
+        merged = dict(JOB_OPTIONS)
+        merged.update(options)
+        merged["geocode_delay"] = float(merged["geocode_delay"])
+        if merged["changed_since"] is not None:
+            try:
+                merged["changed_since"] = parse_timestamp(merged["changed_since"])
+            except (TypeError, ValueError):
+                raise JobError(f"Invalid changed_since time: {merged['changed_since']}")
+        if not merged["dir"]:
+            raise JobError("Missing option: dir")
+        for key in PATH_OPTIONS:
+            if merged[key] and not self._allowed(merged[key]):
+                raise JobError(f"Option {key} is outside the allowed roots", 403)
+        if not os.path.isdir(merged["dir"]):
+            raise JobError(f"Directory does not exist: {merged['dir']}")
+        if merged["strip_location"] and merged["convert_location"]:
+            raise JobError(
+                "strip_location and convert_location cannot be used together"
+            )
+        if (
+            merged["convert_location"]
+            and not merged["nominatim_url"]
+            and self.concurrency > 1
+        ):
+            raise JobError(
+                "convert_location requires nominatim_url when jobs run concurrently; concurrent jobs would exceed the public Nominatim usage policy"
+            )
+        try:
+            selected_transforms(self._args(merged))
+        except KeyError as e:
+            raise JobError(f"Unknown transform: {e.args[0]}")
+
+        with self.lock:
+            busy = self._busy_job(merged["dir"])
+            if busy is not None:
+                raise JobError(
+                    f"Job {busy.id} is {busy.status} for {busy.options['dir']}", 409
+                )
+            job = Job(str(self.next_id), merged)
+            try:
+                self.queue.put_nowait(job)
+            except queue.Full:
+                raise JobError(
+                    f"Job queue is full ({self.queue.maxsize} jobs waiting)", 503
+                )
+            self.next_id += 1
+            self.jobs[job.id] = job
+            self._trim_history()
+        return job
+
+    def _allowed(self, path):
+        if not self.allowed_roots:
+            return True
+        path = os.path.realpath(path)
+        return any(
+            os.path.commonpath([path, root]) == root for root in self.allowed_roots
+        )
+
+    def _busy_job(self, directory):
+        """Return a queued or running job on the directory, inside it or containing it."""
+        directory = os.path.realpath(directory)
+        for job in self.jobs.values():
+            if job.status not in (QUEUED, RUNNING):
+                continue
+            other = os.path.realpath(job.options["dir"])
+            if os.path.commonpath([directory, other]) in (directory, other):
+                return job
+        return None
+
+    def cancel(self, job_id):
+        """Cancel a queued job. Returns False if it is already running or finished."""
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None or job.status != QUEUED:
+                return False
+            job.status = CANCELLED
+            job.finished = time.time()
+            return True
+
+    def _trim_history(self):
+        finished = [
+            job_id
+            for job_id, job in self.jobs.items()
+            if job.status in (SUCCEEDED, FAILED, CANCELLED)
+        ]
+        for job_id in finished[: max(0, len(finished) - self.history)]:
+            del self.jobs[job_id]
+
+    def status(self):
+        """Return daemon-wide metrics."""
+        with self.lock:
+            states = Counter(job.status for job in self.jobs.values())
+        return {
+            "uptime_seconds": time.time() - self.started,
+            "concurrency": self.concurrency,
+            "workers": self.workers,
+            "queue": {"size": self.queue.qsize(), "capacity": self.queue.maxsize},
+            "jobs": dict(states),
+            "geopy_loaded": "geopy" in sys.modules,
+            "location_cache_entries": {
+                url or "public": len(cache)
+                for url, cache in self.location_caches.items()
+            },
+        }
+
+    def _geolocator(self, nominatim_url):
+        with self.lock:
+            if nominatim_url not in self.geolocators:
+                self.geolocators[nominatim_url] = create_geolocator(nominatim_url)
+                self.location_caches[nominatim_url] = LocationCache(self.cache_size)
+            return self.geolocators[nominatim_url], self.location_caches[nominatim_url]
+
+    def _args(self, options):
+        return argparse.Namespace(workers=self.workers, watch=False, **options)
+
+    def _runner(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                return
+            # Under the lock, so a job cancel() reported as cancelled never runs
+            with self.lock:
+                if job.status == CANCELLED:
+                    continue
+                job.status = RUNNING
+                job.started = time.time()
+            if self.log_dir:
+                log = open(
+                    os.path.join(self.log_dir, f"job-{job.id}.log"),
+                    "w",
+                    encoding="utf-8",
+                )
+            else:
+                log = open(os.devnull, "w")
+            sys.stdout.local.stream = log
+            try:
+                self._run(job)
+            except Exception as e:
+                job.status = FAILED
+                job.error = str(e)
+                print_error(f"Error in job {job.id}: {e}")
+            finally:
+                sys.stdout.local.stream = None
+                log.close()
+                job.finished = time.time()
+                with self.lock:
+                    self._trim_history()
+
+    def _run(self, job):
+        """Run all migration steps of a job with main.run_steps, using the warm caches."""
+        args = self._args(job.options)
+        args.scope = scope_from_args(args)
+        sinks = []
+        if args.events:
+            sinks.append(EventLog(args.events))
+        if args.scope is not None:
+            sinks.append(args.scope)
+        state = None
+        if args.incremental:
+            from syncstate import SyncState
+
+            try:
+                state = SyncState(
+                    args.dir,
+                    args.state_db,
+                    workers=args.workers,
+                    options=state_options(args),
+                )
+            except Exception:
+                for sink in sinks:
+                    sink.close()
+                raise
+            sinks.append(state)
+
+        step_options = {}
+        if args.convert_location:
+            geolocator, cache = self._geolocator(args.nominatim_url)
+            step_options["process_location_frontmatter"] = {
+                "geolocator": geolocator,
+                "location_cache": cache,
+            }
+        errors = []
+
+        def on_step(spec, counts, seconds, result, error):
+            job.steps.append(
+                {"name": spec.name, "counts": dict(counts), "seconds": seconds}
+            )
+            if isinstance(result, dict) and args.convert_location:
+                job.geocoding = {
+                    key: result[key]
+                    for key in (
+                        "cache_hits",
+                        "cache_misses",
+                        "api_requests",
+                        "locations_added",
+                        "failed_geocoding",
+                    )
+                    if key in result
+                }
+            if error is not None:
+                errors.append(f"Error during {spec.error_label}: {error}")
+
+        try:
+            if run_steps(args, state, sinks, step_options, on_step) != 0:
+                raise RuntimeError(errors[0] if errors else "Migration failed")
+            job.status = SUCCEEDED
+        finally:
+            for sink in sinks:
+                sink.close()
+
+    def _handler_class(self):
+        daemon = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def _send_json(self, status, payload):
+                body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                if status == 503:
+                    self.send_header("Retry-After", "5")
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _job(self, path):
+                parts = path.strip("/").split("/")
+                if len(parts) == 2 and parts[0] == "jobs":
+                    with daemon.lock:
+                        return daemon.jobs.get(parts[1]), parts[1]
+                return None, None
+
+            def do_GET(self):
+                path = urlsplit(self.path).path
+                if path == "/status":
+                    self._send_json(200, daemon.status())
+                    return
+                if path.rstrip("/") == "/jobs":
+                    with daemon.lock:
+                        jobs = [job.to_dict() for job in daemon.jobs.values()]
+                    self._send_json(200, {"jobs": jobs})
+                    return
+                job, job_id = self._job(path)
+                if job is None:
+                    self._send_json(404, {"error": "Not found"})
+                    return
+                self._send_json(200, job.to_dict())
+
+            def do_POST(self):
+                if urlsplit(self.path).path.rstrip("/") != "/jobs":
+                    self._send_json(404, {"error": "Not found"})
+                    return
+                length = int(self.headers.get("Content-Length") or 0)
+                try:
+                    options = json.loads(self.rfile.read(length) or b"{}")
+                    job = daemon.submit(options)
+                except ValueError as e:
+                    self._send_json(400, {"error": f"Invalid JSON: {e}"})
+                    return
+                except JobError as e:
+                    self._send_json(e.status, {"error": str(e)})
+                    return
+                self._send_json(202, job.to_dict())
+
+            def do_DELETE(self):
+                job, job_id = self._job(urlsplit(self.path).path)
+                if job is None:
+                    self._send_json(404, {"error": "Not found"})
+                    return
+                if not daemon.cancel(job_id):
+                    self._send_json(409, {"error": f"Job {job_id} is {job.status}"})
+                    return
+                self._send_json(200, job.to_dict())
+
+        return Handler
+
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def get_request(self):
+        # Handlers expect a (host, port) client address
+        request, _ = super().get_request()
+        return request, ("local", 0)
+
+
+def _interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run the migration tool as a long-running service accepting jobs over HTTP.",
+        epilog="""
+Submit a job (options are named like main.py's command line options):
+  curl -X POST http://127.0.0.1:8765/jobs -d '{"dir": "/exports/alice", "add_source": true}'
+
+Query it:
+  curl http://127.0.0.1:8765/jobs/1
+  curl http://127.0.0.1:8765/status
+        """,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("--host", default="127.0.0.1", help="Interface to listen on")
+    parser.add_argument(
+        "--port", type=int, default=8765, help="Port to listen on (default: 8765)"
+    )
+    parser.add_argument(
+        "--socket", metavar="PATH", help="Listen on a Unix socket instead of a port"
+    )
+    parser.add_argument(
+        "--queue-size",
+        type=int,
+        default=16,
+        help="Maximum number of queued jobs before submissions are refused (default: 16)",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=1,
+        help="Number of jobs run at the same time (default: 1)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=DEFAULT_WORKERS,
+        help=f"Number of concurrent directory listings per job (default: {DEFAULT_WORKERS})",
+    )
+    parser.add_argument(
+        "--log-dir", metavar="DIR", help="Write each job's output to DIR/job-ID.log"
+    )
+    parser.add_argument(
+        "--allowed-root",
+        action="append",
+        metavar="DIR",
+        help="Refuse jobs naming a directory or file outside DIR (can be repeated; recommended whenever other users can reach the port)",
+    )
+    parser.add_argument(
+        "--cache-size",
+        type=int,
+        default=100000,
+        help="Maximum number of locations cached per Nominatim URL (default: 100000)",
+    )
+    parser.add_argument(
+        "--history",
+        type=int,
+        default=1000,
+        help="Number of finished jobs kept for status queries (default: 1000)",
+    )
+    args = parser.parse_args()
+
+    daemon = MigrationDaemon(
+        host=args.host,
+        port=args.port,
+        socket_path=args.socket,
+        queue_size=args.queue_size,
+        concurrency=args.concurrency,
+        workers=args.workers,
+        log_dir=args.log_dir,
+        history=args.history,
+        allowed_roots=args.allowed_root,
+        cache_size=args.cache_size,
+    )
+    if not args.allowed_root:
+        print_error(
+            "Warning: no --allowed-root given, jobs may name any path this user can write"
+        )
+    daemon.warm()
+    # Service managers stop the daemon with SIGTERM; finish running jobs first
+    signal.signal(signal.SIGTERM, _interrupt)
+    daemon.start(serve=False)
+    print(f"Accepting migration jobs on {daemon.url}", flush=True)
+    try:
+        daemon.server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nStopping, waiting for running jobs to finish...", flush=True)
+    finally:
+        daemon.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
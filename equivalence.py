@@ -0,0 +1,781 @@
+import io
+import os
+import re
+import sys
+import glob
+import random
+import shutil
+import hashlib
+import argparse
+import tempfile
+import functools
+import contextlib
+from urllib.parse import quote, unquote
+from moveresources import move_resources
+from cleanup import (
+    remove_trailing_underscores,
+    remove_empty_resources_dirs,
+    process_location_frontmatter,
+)
+from events import consume
+from geocoding import geopy_available
+from registry import get_transform, register_transform
+from utils import Colors, print_error
+
+# Candidate pipelines checked against the reference, by name
+CANDIDATES = {}
+
+# Match radius of the local Nominatim stand-in; wide enough that most generated
+# coordinates resolve to a place while some still cannot be geocoded
+GEOCODE_RANGE_KM = 2500
+
+# Scope checks age some notebooks to this mtime and select files changed since
+# SCOPE_CHANGED_SINCE, which lies between it and the time the exports are written
+SCOPE_AGED_MTIME = 1000000000
+SCOPE_CHANGED_SINCE = "2005-01-01T00:00:00Z"
+
+# Scope check exclude patterns; like the include patterns, each one matches every
+# name that cleans to the same name, so no rename collision spans the scope boundary
+SCOPE_EXCLUDE_POOL = ["*/Journal*", "*/Todo*", "*/Archive*", "*/Ideas*"]
+
+
+def record_path(front_matter, file_path):
+    """Front matter transform recording the folder and file name it was called with."""
+    folder = os.path.basename(os.path.dirname(file_path))
+    return f"{front_matter}\nfolder: {folder}\nfile: {os.path.basename(file_path)}"
+
+
+# Registered at import time, so sharded worker processes find it too
+register_transform(
+    "record-path",
+    "Record the folder and file name of each note in its front matter",
+    "equivalence:record_path",
+)
+
+
+def register_candidate(name):
+    """Decorator registering a pipeline (directory, options) -> None under a name."""
+
+    def decorator(func):
+        CANDIDATES[name] = func
+        return func
+
+    return decorator
+
+
+def run_steps(directory, options, workers=1, state=None, scope=None):
+    """Run the four migration steps on a directory, as main.py does."""
+    sinks = [scope] if scope is not None else []
+    consume(move_resources(directory, state=state, workers=workers, scope=scope), sinks)
+    consume(remove_trailing_underscores(directory, workers=workers, scope=scope), sinks)
+    consume(remove_empty_resources_dirs(directory, workers=workers, scope=scope), sinks)
+    transforms = [
+        (name, get_transform(name).load()) for name in options.get("transform", [])
+    ]
+    if (
+        options.get("convert_to_location")
+        or options.get("strip_coordinates")
+        or options.get("add_source")
+        or transforms
+    ):
+        consume(
+            process_location_frontmatter(
+                directory,
+                convert_to_location=options.get("convert_to_location", False),
+                strip_coordinates=options.get("strip_coordinates", False),
+                add_source=options.get("add_source", False),
+                transforms=transforms,
+                nominatim_url=options.get("nominatim_url"),
+                request_delay=0,
+                state=state,
+                workers=workers,
+                scope=scope,
+            ),
+            sinks,
+        )
+
+
+def reference_pipeline(directory, options):
+    """The sequential pipeline every optimized mode must match."""
+    run_steps(directory, options, workers=1)
+
+
+@register_candidate("parallel")
+def parallel_pipeline(directory, options):
+    """Steps walking the tree with the concurrent crawler."""
+    run_steps(directory, options, workers=8)
+
+
+@register_candidate("incremental")
+def incremental_pipeline(directory, options):
+    """An incremental run followed by a rerun, which must not change anything."""
+    from syncstate import SyncState
+
+    with tempfile.TemporaryDirectory(prefix="joplin-equivalence-state-") as tmp:
+        state = SyncState(
+            directory, os.path.join(tmp, "state.db"), workers=4, options=options
+        )
+        try:
+            for _ in range(2):
+                run_steps(directory, options, workers=4, state=state)
+                state.commit()
+        finally:
+            state.close()
+
+
+@register_candidate("scoped")
+def scoped_pipeline(directory, options):
+    """
+    Steps filtered by include and exclude rules that select everything. Scopes that
+    select part of the vault are checked by check_scope.
+    """
+    from scope import Scope
+
+    scope = Scope(directory, include=["*"], exclude=["*.unused"])
+    run_steps(directory, options, workers=4, scope=scope)
+
+
+@register_candidate("sharded")
+def sharded_pipeline(directory, options):
+    """The sharded migration with four worker processes."""
+    from shard import run_local
+
+    with tempfile.TemporaryDirectory(prefix="joplin-equivalence-shards-") as tmp:
+        failed = run_local(
+            directory,
+            tmp,
+            {
+                "strip_location": options.get("strip_coordinates", False),
+                "convert_location": options.get("convert_to_location", False),
+                "add_source": options.get("add_source", False),
+                "transform": options.get("transform", []),
+                "nominatim_url": options.get("nominatim_url"),
+                "geocode_delay": 0,
+            },
+            processes=4,
+            workers=2,
+        )
+        if failed:
+            raise RuntimeError(f"Shards failed: {', '.join(failed)}")
+
+
+# Generated exports
+
+
+NAME_POOL = ["Inbox", "Work", "Travel", "Recipes", "Ideas", "Archive", "Misc"]
+
+
+def _odd_name(rng, base):
+    """Return a name that sometimes carries the trailing underscores Joplin adds."""
+    return base + rng.choice(["", "", "", "_", "__", " ", "_ "])
+
+
+def generate_export(directory, rng):
+    """
+    Write a random Joplin-style export to a directory.
+
+    The export covers nested notebooks, names with trailing underscores and spaces
+    (including ones that collide once cleaned), resources shared between notes
+    and notebooks, URL-encoded names, missing resources, HTML images and front
+    matter with and without coordinates.
+    """
+    resources_dir = os.path.join(directory, "_resources")
+    os.makedirs(resources_dir)
+
+    resources = []
+    for i in range(rng.randint(0, 12)):
+        name = _odd_name(rng, rng.choice(["image", "scan", "photo", "doc file"]))
+        name = f"{name}{i}" if rng.random() < 0.8 else name
+        name += rng.choice([".png", ".jpg", ".pdf", "_.png"])
+        if name in resources:
+            continue
+        with open(os.path.join(resources_dir, name), "wb") as f:
+            noise = bytes(rng.getrandbits(8) for _ in range(rng.randint(0, 16)))
+            f.write(f"resource {i}".encode() + noise)
+        resources.append(name)
+
+    notebooks = [""]
+    for _ in range(rng.randint(0, 6)):
+        parent = rng.choice(notebooks)
+        if parent.count(os.sep) >= 2:
+            continue
+        child = os.path.join(parent, _odd_name(rng, rng.choice(NAME_POOL)))
+        notebooks.append(child)
+        os.makedirs(os.path.join(directory, child), exist_ok=True)
+
+    for i in range(rng.randint(1, 10)):
+        notebook = rng.choice(notebooks)
+        depth = 0 if not notebook else notebook.count(os.sep) + 1
+        prefix = "../" * depth
+        name = _odd_name(rng, rng.choice(["Note", "Todo", "Journal"]) + f" {i % 4}")
+        path = os.path.join(directory, notebook, name + ".md")
+        if os.path.exists(path):
+            continue
+
+        front_matter = [f"title: {name}", "updated: 2024-01-01 10:00:00Z"]
+        if rng.random() < 0.5:
+            front_matter.append(f"latitude: {rng.uniform(-80, 80):.8f}")
+            front_matter.append(f"longitude: {rng.uniform(-170, 170):.8f}")
+            front_matter.append(f"altitude: {rng.uniform(0, 500):.4f}")
+        if rng.random() < 0.2:
+            front_matter.append("source: Evernote")
+
+        body = [f"Body of note {i}", ""]
+        for _ in range(rng.randint(0, 4)):
+            target = (
+                rng.choice(resources)
+                if resources and rng.random() < 0.85
+                else "missing.png"
+            )
+            encoded = quote(target) if rng.random() < 0.5 else target
+            kind = rng.choice(["image", "link", "html"])
+            if kind == "image":
+                body.append(f"![{target}]({prefix}_resources/{encoded})")
+            elif kind == "link":
+                body.append(f"[Attachment {target}]({prefix}_resources/{encoded})")
+            else:
+                body.append(f'<img src="{prefix}_resources/{encoded}" width="200"/>')
+
+        content = "---\n" + "\n".join(front_matter) + "\n---\n\n" + "\n".join(body)
+        if rng.random() < 0.1:
+            content = "\n".join(body)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(content + "\n")
+
+
+# Snapshots and comparison
+
+LINK_PATTERN = re.compile(r'\]\(([^)]*)\)|src="([^"]*)"')
+
+
+def _front_matter(content):
+    if content.startswith("---\n"):
+        parts = content.split("---\n", 2)
+        if len(parts) >= 3:
+            return [line for line in parts[1].splitlines() if line.strip()]
+    return None
+
+
+def snapshot(directory):
+    """
+    Describe a vault tree for comparison.
+
+    Returns:
+        Dict of relative path -> entry, where entries describe directories, file
+        bytes (as a hash), and for notes their front matter lines and link targets
+        (resolved relative to the note, with whether the target exists)
+    """
+    tree = {}
+    for root, dirs, files in os.walk(directory):
+        for dir_name in dirs:
+            rel = os.path.relpath(os.path.join(root, dir_name), directory)
+            tree[rel] = {"type": "dir"}
+        for file in files:
+            path = os.path.join(root, file)
+            rel = os.path.relpath(path, directory)
+            with open(path, "rb") as f:
+                data = f.read()
+            entry = {"type": "file", "hash": hashlib.sha256(data).hexdigest()}
+            if file.lower().endswith((".md", ".markdown")):
+                content = data.decode("utf-8", errors="replace")
+                entry["front_matter"] = _front_matter(content)
+                links = []
+                for match in LINK_PATTERN.finditer(content):
+                    target = unquote(match.group(1) or match.group(2))
+                    resolved = os.path.normpath(os.path.join(root, target))
+                    links.append(
+                        (
+                            os.path.relpath(resolved, directory),
+                            os.path.exists(resolved),
+                        )
+                    )
+                entry["links"] = links
+            tree[rel] = entry
+    return tree
+
+
+def compare(expected, actual):
+    """
+    Compare two snapshots.
+
+    Returns:
+        List of human-readable differences, grouped by paths, front matter, links
+        and bytes; empty if the trees are equivalent
+    """
+    differences = []
+    for rel in sorted(set(expected) - set(actual)):
+        differences.append(f"missing path: {rel}")
+    for rel in sorted(set(actual) - set(expected)):
+        differences.append(f"unexpected path: {rel}")
+    for rel in sorted(set(expected) & set(actual)):
+        want, got = expected[rel], actual[rel]
+        if want["type"] != got["type"]:
+            differences.append(f"type differs: {rel} ({want['type']} != {got['type']})")
+            continue
+        if want["type"] == "dir" or want["hash"] == got["hash"]:
+            continue
+        if want.get("front_matter") != got.get("front_matter"):
+            differences.append(
+                f"front matter differs: {rel}: {want.get('front_matter')} != {got.get('front_matter')}"
+            )
+        if want.get("links") != got.get("links"):
+            differences.append(
+                f"link targets differ: {rel}: {want.get('links')} != {got.get('links')}"
+            )
+        differences.append(f"bytes differ: {rel}")
+    return differences
+
+
+def check(export, candidate, options):
+    """
+    Run the reference and a candidate pipeline on copies of an export and compare.
+
+    An exception raised by either pipeline is reported as a difference.
+    """
+    with tempfile.TemporaryDirectory(prefix="joplin-equivalence-") as tmp:
+        trees = []
+        for name, pipeline in (
+            ("reference", reference_pipeline),
+            ("candidate", candidate),
+        ):
+            # Same vault name in every copy, for transforms that record paths
+            vault = os.path.join(tmp, name, "vault")
+            shutil.copytree(export, vault)
+            try:
+                with contextlib.redirect_stdout(io.StringIO()):
+                    pipeline(vault, options)
+            except Exception as e:
+                return [f"{name} pipeline raised {type(e).__name__}: {e}"]
+            trees.append(snapshot(vault))
+        return compare(*trees)
+
+
+# Scope checks
+
+
+def _clean_name(name):
+    return name.rstrip("_ ")
+
+
+def random_scope(export, rng):
+    """
+    Pick a scope for check_scope that selects part of an export.
+
+    Includes are whole top-level notebooks, by prefix pattern or by their exact export
+    names, or notebooks nested in a top-level notebook with a clean name, so that the
+    walk has to descend into folders the scope does not contain. Excludes come from
+    SCOPE_EXCLUDE_POOL. Some top-level notebooks (and
+    sometimes the notes in the root) are aged so that changed_since leaves them alone.
+
+    Returns:
+        Dictionary of include, exclude, changed_since (an ISO 8601 string or None),
+        aged (cleaned names of aged top-level notebooks) and aged_root
+    """
+    groups = {}
+    for entry in sorted(os.scandir(export), key=lambda entry: entry.name):
+        if entry.is_dir() and entry.name != "_resources":
+            groups.setdefault(_clean_name(entry.name), []).append(entry.name)
+    names = sorted(groups)
+    include = []
+    for name in names:
+        if rng.random() < 0.5:
+            continue
+        nested = set()
+        if name in groups[name]:
+            for entry in os.scandir(os.path.join(export, name)):
+                if entry.is_dir():
+                    nested.add(_clean_name(entry.name))
+        kind = rng.choice(
+            ["prefix", "exact", "nested"] if nested else ["prefix", "exact"]
+        )
+        if kind == "prefix":
+            include.append(f"{glob.escape(name)}*")
+        elif kind == "exact":
+            # Exact export names only keep matching after renames if the scope follows them
+            include.extend(glob.escape(member) for member in groups[name])
+        else:
+            # The clean parent is never renamed, so a prefix below it keeps matching
+            child = rng.choice(sorted(nested))
+            include.append(f"{glob.escape(name)}/{glob.escape(child)}*")
+    exclude = [pattern for pattern in SCOPE_EXCLUDE_POOL if rng.random() < 0.3]
+    aged = []
+    aged_root = False
+    changed_since = None
+    if rng.random() < 0.5:
+        aged = [name for name in names if rng.random() < 0.3]
+        aged_root = rng.random() < 0.3
+        changed_since = SCOPE_CHANGED_SINCE
+    return {
+        "include": include,
+        "exclude": exclude,
+        "changed_since": changed_since,
+        "aged": aged,
+        "aged_root": aged_root,
+    }
+
+
+def _age(directory, spec):
+    for entry in os.scandir(directory):
+        if entry.is_dir(follow_symlinks=False):
+            if _clean_name(entry.name) not in spec["aged"]:
+                continue
+            for root, _, files in os.walk(entry.path):
+                for file in files:
+                    path = os.path.join(root, file)
+                    os.utime(path, (SCOPE_AGED_MTIME, SCOPE_AGED_MTIME))
+        elif spec["aged_root"]:
+            os.utime(entry.path, (SCOPE_AGED_MTIME, SCOPE_AGED_MTIME))
+
+
+def _scope_selection(directory, scope, by_time):
+    """
+    Return the paths of an unprocessed export that a scoped run handles.
+
+    Returns:
+        Tuple of (files, dirs) sets of relative paths: the files the scope selects and
+        the directories the sequential pipeline must see to produce the same names for
+        them. Directories the scoped run renames are kept, and so are directories it
+        does not rename but could collide with (names without trailing underscores
+        or spaces). The root _resources directory is handled separately.
+
+    Args:
+        directory: Unprocessed export, after _age
+        scope: Scope without changed_since giving the include and exclude patterns
+        by_time: True if the scoped run uses changed_since; files _age touched are
+                 then left out, without relying on the scope's timestamp handling
+    """
+    files = set()
+    holding = set()
+    for root, dirs, names in os.walk(directory, topdown=False):
+        rel_root = os.path.relpath(root, directory)
+        if rel_root.split(os.sep)[0] == "_resources":
+            continue
+        for name in names:
+            path = os.path.join(root, name)
+            if scope.contains(path) and not (
+                by_time and os.stat(path).st_mtime == SCOPE_AGED_MTIME
+            ):
+                files.add(os.path.normpath(os.path.join(rel_root, name)))
+                holding.add(os.path.normpath(rel_root))
+        for name in dirs:
+            if os.path.normpath(os.path.join(rel_root, name)) in holding:
+                holding.add(os.path.normpath(rel_root))
+
+    dirs = set()
+    for root, names, _ in os.walk(directory):
+        rel_root = os.path.normpath(os.path.relpath(root, directory))
+        kept = []
+        for name in names:
+            rel = os.path.normpath(os.path.join(rel_root, name))
+            renamed = scope.contains(os.path.join(root, name)) and (
+                not by_time or rel in holding
+            )
+            if rel != "_resources" and (
+                rel in holding or renamed or _clean_name(name) == name
+            ):
+                dirs.add(rel)
+                kept.append(name)
+        names[:] = kept
+    return files, dirs
+
+
+def _reduce(directory, files, dirs):
+    """Delete everything but the given files and dirs, keeping the root _resources."""
+    for root, names, file_names in os.walk(directory):
+        rel_root = os.path.normpath(os.path.relpath(root, directory))
+        if rel_root == "_resources":
+            names[:] = []
+            continue
+        for name in file_names:
+            if os.path.normpath(os.path.join(rel_root, name)) not in files:
+                os.remove(os.path.join(root, name))
+        kept = []
+        for name in names:
+            rel = os.path.normpath(os.path.join(rel_root, name))
+            if rel in dirs or rel == "_resources":
+                kept.append(name)
+            else:
+                shutil.rmtree(os.path.join(root, name))
+        names[:] = kept
+
+
+def check_scope(export, options, spec):
+    """
+    Run a scoped pipeline on a copy of an export and check both sides of the scope.
+
+    Paths outside the scope must come out byte-identical to the input, under their
+    export names. Paths inside it must match the sequential pipeline run on a copy
+    of the export reduced to the selected notes (see _scope_selection). The root
+    _resources folder must keep the same resources as in that run.
+
+    Args:
+        export: Export directory, never modified
+        options: Front matter options, as for the candidate pipelines
+        spec: Scope description returned by random_scope
+
+    Returns:
+        List of human-readable differences; empty if the scoped run is correct
+    """
+    from scope import Scope, parse_timestamp
+
+    changed_since = spec["changed_since"]
+    if changed_since is not None:
+        changed_since = parse_timestamp(changed_since)
+
+    def make_scope(directory):
+        return Scope(directory, spec["include"], spec["exclude"], changed_since)
+
+    with tempfile.TemporaryDirectory(prefix="joplin-equivalence-scope-") as tmp:
+        source = os.path.join(tmp, "input")
+        shutil.copytree(export, source)
+        _age(source, spec)
+        expected_outside = snapshot(source)
+        files, dirs = _scope_selection(
+            source, Scope(source, spec["include"], spec["exclude"]), bool(changed_since)
+        )
+
+        scoped = os.path.join(tmp, "scoped", "vault")
+        reference = os.path.join(tmp, "reference", "vault")
+        shutil.copytree(source, scoped)
+        shutil.copytree(source, reference)
+        _reduce(reference, files, dirs)
+        scope = make_scope(scoped)
+        for name, vault, pipeline in (
+            ("reference", reference, reference_pipeline),
+            ("scoped", scoped, functools.partial(run_steps, workers=4, scope=scope)),
+        ):
+            try:
+                with contextlib.redirect_stdout(io.StringIO()):
+                    pipeline(vault, options)
+            except Exception as e:
+                return [f"{name} pipeline raised {type(e).__name__}: {e}"]
+
+        differences = []
+        inside = {}
+        outside = set()
+        for rel, entry in snapshot(scoped).items():
+            if rel == "_resources":
+                continue
+            original = os.path.normpath(scope.relative(os.path.join(scoped, rel)))
+            if original not in expected_outside:
+                inside[rel] = entry
+            elif original in (files if entry["type"] == "file" else dirs):
+                inside[rel] = entry
+            else:
+                outside.add(original)
+                resource = original.split(os.sep)[0] == "_resources"
+                if not resource and os.path.basename(rel) != os.path.basename(original):
+                    differences.append(f"renamed outside the scope: {original}")
+                elif entry.get("hash") != expected_outside[original].get("hash"):
+                    differences.append(f"changed outside the scope: {original}")
+        for original in sorted(set(expected_outside) - files - dirs - outside):
+            if original.split(os.sep)[0] != "_resources":
+                differences.append(f"missing outside the scope: {original}")
+
+        # Resources left in the root _resources folder keep their export names in
+        # the scoped run, while the reference cleans them; their bytes must match
+        expected_inside = {}
+        leftovers = []
+        for rel, entry in snapshot(reference).items():
+            if rel.split(os.sep)[0] != "_resources":
+                expected_inside[rel] = entry
+            elif rel != "_resources":
+                leftovers.append(entry["hash"])
+        scoped_leftovers = [
+            entry["hash"]
+            for rel, entry in snapshot(os.path.join(scoped, "_resources")).items()
+        ]
+        if sorted(leftovers) != sorted(scoped_leftovers):
+            differences.append(
+                f"root _resources differs: {len(scoped_leftovers)} files left, expected {len(leftovers)}"
+            )
+        return differences + compare(expected_inside, inside)
+
+
+# Minimization
+
+
+def _export_files(export):
+    files = []
+    for root, _, names in os.walk(export):
+        for name in names:
+            files.append(os.path.relpath(os.path.join(root, name), export))
+    return sorted(files)
+
+
+def _subset_export(export, files, destination):
+    os.makedirs(os.path.join(destination, "_resources"), exist_ok=True)
+    for rel in files:
+        target = os.path.join(destination, rel)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        shutil.copy2(os.path.join(export, rel), target)
+
+
+def minimize(export, run_check, destination):
+    """
+    Shrink a failing export with delta debugging and write the result to destination.
+
+    Files (notes and resources) are removed in shrinking chunks for as long as the
+    check still reports differences.
+
+    Args:
+        export: The failing export
+        run_check: Callable (export) -> list of differences, e.g. check with its
+                   candidate and options bound
+        destination: Directory the minimized export is written to
+
+    Returns:
+        The differences reported for the minimized export
+    """
+    files = _export_files(export)
+    workdir = tempfile.mkdtemp(prefix="joplin-equivalence-minimize-")
+
+    def fails(subset):
+        trial = os.path.join(workdir, "trial")
+        shutil.rmtree(trial, ignore_errors=True)
+        _subset_export(export, subset, trial)
+        return bool(run_check(trial))
+
+    try:
+        chunks = 2
+        while len(files) >= 2:
+            size = max(1, len(files) // chunks)
+            reduced = False
+            for start in range(0, len(files), size):
+                complement = files[:start] + files[start + size :]
+                if fails(complement):
+                    files = complement
+                    chunks = max(chunks - 1, 2)
+                    reduced = True
+                    break
+            if not reduced:
+                if size == 1:
+                    break
+                chunks = min(len(files), chunks * 2)
+
+        shutil.rmtree(destination, ignore_errors=True)
+        _subset_export(export, files, destination)
+        return run_check(destination)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Check that optimized execution modes produce exactly the vault the sequential pipeline produces.",
+    )
+    parser.add_argument(
+        "--candidate",
+        action="append",
+        choices=sorted(CANDIDATES),
+        help="Candidate pipeline to check (can be repeated; default: all)",
+    )
+    parser.add_argument(
+        "--cases",
+        type=int,
+        default=100,
+        help="Number of generated exports to check (default: 100)",
+    )
+    parser.add_argument(
+        "--seed", type=int, default=0, help="Seed of the first case (default: 0)"
+    )
+    parser.add_argument(
+        "--fixture",
+        action="append",
+        default=[],
+        metavar="DIR",
+        help="Existing Joplin export to check in addition to the generated ones (can be repeated, never modified)",
+    )
+    parser.add_argument(
+        "--minimize-to",
+        metavar="DIR",
+        help="Write a minimized copy of the first failing export to DIR",
+    )
+    args = parser.parse_args()
+
+    candidates = args.candidate or sorted(CANDIDATES)
+    workdir = tempfile.mkdtemp(prefix="joplin-equivalence-exports-")
+    failures = 0
+    total = 0
+    # Location conversion runs against a local stand-in, so it is checked offline
+    stub = None
+    if geopy_available():
+        from nominatim_stub import NominatimStub
+
+        stub = NominatimStub(max_distance_km=GEOCODE_RANGE_KM).start()
+    else:
+        print_error("geopy not installed, location conversion is not checked")
+    try:
+        cases = [(f"fixture {path}", path, None) for path in args.fixture]
+        for seed in range(args.seed, args.seed + args.cases):
+            cases.append((f"seed {seed}", None, seed))
+
+        for label, export, seed in cases:
+            if export is None:
+                export = os.path.join(workdir, f"seed-{seed}")
+                generate_export(export, random.Random(seed))
+            option_rng = random.Random(seed if seed is not None else label)
+            options = {
+                "strip_coordinates": option_rng.random() < 0.5,
+                "add_source": option_rng.random() < 0.5,
+            }
+            if stub is not None and option_rng.random() < 0.3:
+                options["strip_coordinates"] = False
+                options["convert_to_location"] = True
+                options["nominatim_url"] = stub.url
+            # Transforms get the note's path, which must be its final one
+            if option_rng.random() < 0.3:
+                options["transform"] = ["record-path"]
+
+            checks = [
+                (
+                    name,
+                    options,
+                    functools.partial(
+                        check, candidate=CANDIDATES[name], options=options
+                    ),
+                )
+                for name in candidates
+            ]
+            if "scoped" in candidates:
+                spec = random_scope(export, random.Random(f"scope {label}"))
+                checks.append(
+                    (
+                        "scoped subset",
+                        dict(options, scope=spec),
+                        functools.partial(check_scope, options=options, spec=spec),
+                    )
+                )
+
+            for name, description, run_check in checks:
+                total += 1
+                differences = run_check(export)
+                if not differences:
+                    continue
+                failures += 1
+                print_error(f"{name}: {label} differs from the reference {description}")
+                for line in differences[:20]:
+                    print(f"  {line}")
+                if args.minimize_to and failures == 1:
+                    differences = minimize(export, run_check, args.minimize_to)
+                    print(
+                        f"  Minimized export written to {args.minimize_to} ({len(_export_files(args.minimize_to))} files, {len(differences)} differences)"
+                    )
+            if export.startswith(workdir):
+                shutil.rmtree(export, ignore_errors=True)
+    finally:
+        if stub is not None:
+            stub.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if failures:
+        print_error(f"{failures} of {total} checks differ from the reference")
+        return 1
+    print(
+        f"{Colors.GREEN}All {total} checks match the reference ({', '.join(candidates)}){Colors.RESET}"
+    )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
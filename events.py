@@ -0,0 +1,82 @@
+import json
+import time
+from collections import Counter, namedtuple
+
+# Kinds of result events yielded by the migration steps
+MOVED = "moved"
+RENAMED = "renamed"
+REWRITTEN = "rewritten"
+REMOVED = "removed"
+ERROR = "error"
+
+
+class Event(
+    namedtuple("Event", "kind step path source message", defaults=(None, None))
+):
+    """
+    Result of a single operation performed by a migration step.
+
+    Attributes:
+        kind: One of MOVED, RENAMED, REWRITTEN, REMOVED or ERROR
+        step: Name of the step that produced the event (e.g. "move_resources")
+        path: The affected path (the new path for moves and renames)
+        source: The original path for moves and renames
+        message: Human-readable detail, used for errors
+    """
+
+    __slots__ = ()
+
+    def to_dict(self):
+        return {
+            key: value for key, value in self._asdict().items() if value is not None
+        }
+
+
+class EventLog:
+    """JSON-lines sink that writes one object per event as it happens."""
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "a", encoding="utf-8")
+
+    def emit(self, event):
+        record = {"time": time.time()}
+        record.update(event.to_dict())
+        self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def consume(events, sinks=()):
+    """
+    Drain a step's events into the given sinks.
+
+    Args:
+        events: Iterable of Event objects, typically a step generator
+        sinks: Objects with an emit(event) method
+
+    Returns:
+        Counter of event kinds
+    """
+    return drain(events, sinks)[0]
+
+
+def drain(events, sinks=()):
+    """
+    Like consume, but also return the value the step generator returned.
+
+    Returns:
+        Tuple of (Counter of event kinds, return value or None)
+    """
+    counts = Counter()
+    events = iter(events)
+    while True:
+        try:
+            event = next(events)
+        except StopIteration as stop:
+            return counts, stop.value
+        counts[event.kind] += 1
+        for sink in sinks:
+            sink.emit(event)
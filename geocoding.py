@@ -0,0 +1,216 @@
+import time
+import threading
+import importlib.util
+from collections import OrderedDict
+from urllib.parse import urlsplit
+from utils import print_status, print_error
+
+USER_AGENT = "joplin-to-obsidian-converter"
+
+# geopy and its HTTP stack are only imported once a location is actually geocoded
+
+
+def geopy_available():
+    """Return True if geopy is installed, without importing it."""
+    return importlib.util.find_spec("geopy") is not None
+
+
+class LocationCache:
+    """
+    Location cache of coordinates -> location name holding at most maxsize entries.
+
+    Can be passed wherever a plain dictionary cache is accepted. When full, the least
+    recently used entry is evicted. Safe to share between threads.
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        with self.lock:
+            if key not in self.entries:
+                return False
+            # Callers look a key up right after checking for it; keep it until then
+            self.entries.move_to_end(key)
+            return True
+
+    def __getitem__(self, key):
+        with self.lock:
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+    def __setitem__(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+
+def create_geolocator(nominatim_url=None):
+    """
+    Create a Nominatim geolocator, importing geopy on first use.
+
+    Args:
+        nominatim_url: Optional base URL of a self-hosted Nominatim instance or a local
+                       stand-in (e.g. "http://127.0.0.1:8088"); defaults to the public service
+    """
+    from geopy.geocoders import Nominatim
+
+    if not nominatim_url:
+        return Nominatim(user_agent=USER_AGENT)
+
+    url = urlsplit(nominatim_url)
+    return Nominatim(
+        user_agent=USER_AGENT,
+        scheme=url.scheme or "https",
+        domain=url.netloc + url.path.rstrip("/"),
+    )
+
+
+def get_location_name(
+    latitude,
+    longitude,
+    geolocator=None,
+    cache=None,
+    max_retries=3,
+    debug=False,
+    delay=1.0,
+    timeout=10,
+):
+    """
+    Convert latitude and longitude to a human-readable location name.
+    Returns the most specific location available (city, town, village, or region).
+    Uses caching to avoid redundant API calls for the same coordinates.
+
+    Args:
+        latitude: Latitude coordinate
+        longitude: Longitude coordinate
+        geolocator: Optional pre-initialized Nominatim geolocator instance
+        cache: Optional dictionary to cache results (coordinates tuple -> location name)
+        max_retries: Number of retry attempts for timeouts (default: 3)
+        debug: If True, print debug messages for API requests (default: False)
+        delay: Seconds to wait before each request, twice that before a retry (default: 1.0)
+        timeout: Seconds to wait for a response before retrying (default: 10)
+
+    Returns:
+        String with location name (e.g., "New York, New York, United States") or None if failed
+    """
+    if not geopy_available():
+        return None
+
+    from geopy.exc import GeocoderTimedOut, GeocoderServiceError
+
+    # Round coordinates to reduce cache misses from minor differences
+    # 5 decimal places = ~1.1 meter precision, good enough for city-level lookup
+    coord_key = (round(latitude, 5), round(longitude, 5))
+
+    # Check cache first
+    if cache is not None and coord_key in cache:
+        if debug:
+            cached_value = cache[coord_key]
+            if cached_value:
+                print_status(
+                    f"[DEBUG] Cache HIT for ({latitude}, {longitude}) -> {cached_value}"
+                )
+            else:
+                print_status(
+                    f"[DEBUG] Cache HIT for ({latitude}, {longitude}) -> (no location found)"
+                )
+        return cache[coord_key]
+
+    try:
+        # Use provided geolocator or create new one
+        if geolocator is None:
+            geolocator = create_geolocator()
+
+        # Retry logic for handling timeouts
+        for attempt in range(max_retries):
+            try:
+                # Respect Nominatim's usage policy: max 1 request per second
+                time.sleep(delay)
+
+                if debug:
+                    print_status(
+                        f"[DEBUG] Making API request for ({latitude}, {longitude}) - Attempt {attempt + 1}/{max_retries}"
+                    )
+
+                location = geolocator.reverse(
+                    f"{latitude}, {longitude}", language="en", timeout=timeout
+                )
+
+                if debug:
+                    if location:
+                        print_status(
+                            f"[DEBUG] API response received for ({latitude}, {longitude})"
+                        )
+                    else:
+                        print_status(
+                            f"[DEBUG] API returned no location for ({latitude}, {longitude})"
+                        )
+
+                if location and location.raw.get("address"):
+                    address = location.raw["address"]
+
+                    # Try to get the most specific location in order of preference
+                    location_parts = []
+
+                    # City, town, or village
+                    if "city" in address:
+                        location_parts.append(address["city"])
+                    elif "town" in address:
+                        location_parts.append(address["town"])
+                    elif "village" in address:
+                        location_parts.append(address["village"])
+                    elif "hamlet" in address:
+                        location_parts.append(address["hamlet"])
+                    elif "municipality" in address:
+                        location_parts.append(address["municipality"])
+
+                    # State/Region
+                    if "state" in address:
+                        location_parts.append(address["state"])
+                    elif "region" in address:
+                        location_parts.append(address["region"])
+
+                    # Country
+                    if "country" in address:
+                        location_parts.append(address["country"])
+
+                    if location_parts:
+                        result = ", ".join(location_parts)
+                        # Cache the successful result
+                        if cache is not None:
+                            cache[coord_key] = result
+                        return result
+
+                # Cache the None result to avoid retrying failed lookups
+                if cache is not None:
+                    cache[coord_key] = None
+                return None
+
+            except GeocoderTimedOut:
+                if attempt < max_retries - 1:
+                    print_status(
+                        f"Geocoding timeout for ({latitude}, {longitude}), retrying... (attempt {attempt + 2}/{max_retries})"
+                    )
+                    time.sleep(2 * delay)  # Wait a bit longer before retry
+                else:
+                    print_error(
+                        f"Geocoding timeout for ({latitude}, {longitude}) after {max_retries} attempts"
+                    )
+                    return None
+            except GeocoderServiceError as e:
+                print_error(
+                    f"Geocoding service error for ({latitude}, {longitude}): {e}"
+                )
+                return None
+
+    except Exception as e:
+        print_error(f"Error during geocoding: {e}")
+        return None
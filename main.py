@@ -1,20 +1,21 @@
 import os
 import sys
+import time
+import sqlite3
 import argparse
-from moveresources import move_resources
-from cleanup import (
-    remove_trailing_underscores,
-    remove_empty_resources_dirs,
-    process_location_frontmatter,
+from crawler import DEFAULT_WORKERS
+from events import Event, EventLog, ERROR, consume, drain
+from registry import (
+    STEPS,
+    TRANSFORM_ENTRY_POINT_GROUP,
+    selected_transforms,
+    state_options,
 )
+from scope import parse_timestamp, scope_from_args
 from utils import Colors, print_status, print_error, print_step
 
-# Operations that will be performed (base operations, location handling depends on flags)
-OPERATIONS = [
-    "Move resources from _resources directory to _resources folders next to markdown files",
-    "Remove trailing underscores and spaces from files and folders",
-    "Remove empty _resources directories",
-]
+# Operations that will be performed (base operations, front matter handling depends on flags)
+OPERATIONS = [spec.description for spec in STEPS if spec.description]
 
 
 def main():
@@ -50,6 +51,18 @@ Use --help to see this message.
         action="store_true",
         help="Convert latitude/longitude to human-readable location names and add as 'location' field (keeps coordinates, requires geopy: pip install geopy)",
     )
+    parser.add_argument(
+        "--nominatim-url",
+        metavar="URL",
+        help="Base URL of a self-hosted Nominatim instance to use for --convert-location (default: the public OpenStreetMap service)",
+    )
+    parser.add_argument(
+        "--geocode-delay",
+        type=float,
+        default=1.0,
+        metavar="SECONDS",
+        help="Seconds to wait between geocoding requests; only lower this for a self-hosted instance (default: 1)",
+    )
     parser.add_argument(
         "--debug",
         action="store_true",
@@ -60,6 +73,60 @@ Use --help to see this message.
         action="store_true",
         help="Add 'source: Joplin' field to YAML front matter of all notes",
     )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Keep a state index of notes and resources and only process those that are new or changed since the last run",
+    )
+    parser.add_argument(
+        "--state-db",
+        help="Path of the incremental state database (default: .joplin-to-obsidian.db in the target directory)",
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="Keep running and apply changes whenever new or changed notes appear (implies --incremental)",
+    )
+    parser.add_argument(
+        "--watch-interval",
+        type=float,
+        default=60.0,
+        help="Seconds between checks for changes in --watch mode (default: 60)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=DEFAULT_WORKERS,
+        help=f"Number of concurrent directory listings when walking the vault, useful on network filesystems; 1 walks sequentially (default: {DEFAULT_WORKERS})",
+    )
+    parser.add_argument(
+        "--events",
+        metavar="FILE",
+        help="Append a JSON-lines log of every operation (moved, renamed, rewritten, removed, error) to FILE",
+    )
+    parser.add_argument(
+        "--transform",
+        action="append",
+        metavar="NAME",
+        help=f"Apply an additional front matter transform, registered by a plugin under the '{TRANSFORM_ENTRY_POINT_GROUP}' entry point group (can be repeated)",
+    )
+    parser.add_argument(
+        "--include",
+        action="append",
+        metavar="GLOB",
+        help="Only process paths matching this pattern, relative to the vault root (e.g. 'Travel' or 'Work/2024*'); a matching folder includes everything inside it (can be repeated)",
+    )
+    parser.add_argument(
+        "--exclude",
+        action="append",
+        metavar="GLOB",
+        help="Leave paths matching this pattern alone, even if included (can be repeated)",
+    )
+    parser.add_argument(
+        "--changed-since",
+        metavar="TIME",
+        help="Only process files modified at or after TIME, an ISO 8601 date or date and time (e.g. 2024-05-01 or 2024-05-01T18:30) or seconds since the epoch",
+    )
     args = parser.parse_args()
 
     if not os.path.exists(args.dir):
@@ -77,6 +144,20 @@ Use --help to see this message.
         )
         return 1
 
+    try:
+        transforms = selected_transforms(args)
+    except KeyError as e:
+        print_error(f"Error: Unknown transform: {e.args[0]}")
+        return 1
+
+    if args.changed_since is not None:
+        try:
+            args.changed_since = parse_timestamp(args.changed_since)
+        except ValueError:
+            print_error(f"Error: Invalid --changed-since time: {args.changed_since}")
+            return 1
+    args.scope = scope_from_args(args)
+
     # Show what will be done and ask for confirmation
     print(f"{Colors.YELLOW}Obsidian Vault Migration and Cleanup Tool{Colors.RESET}")
     print("=" * 50)
@@ -92,20 +173,26 @@ Use --help to see this message.
 
     # Show operations, adjusting for flags
     operations_to_show = OPERATIONS.copy()
-    if args.strip_location:
-        operations_to_show.append(
-            "Remove location data (latitude, longitude, altitude) from YAML front matter"
-        )
-    elif args.convert_location:
-        operations_to_show.append(
-            "Add human-readable location names from coordinates (keeping original coordinates)"
-        )
+    operations_to_show.extend(spec.description for spec in transforms)
 
-    if args.add_source:
-        operations_to_show.append("Add 'source: Joplin' field to YAML front matter")
+    if args.watch:
+        args.incremental = True
 
     for i, operation in enumerate(operations_to_show, 1):
         print(f"{i}. {operation}")
+    if args.incremental:
+        print(
+            "\nIncremental mode: only new or changed notes and resources will be processed"
+        )
+    if args.watch:
+        print(f"Watch mode: checking for changes every {args.watch_interval:g} seconds")
+    if args.include:
+        print(f"\nOnly paths matching: {', '.join(args.include)}")
+    if args.exclude:
+        print(f"Excluding paths matching: {', '.join(args.exclude)}")
+    if args.changed_since is not None:
+        since = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(args.changed_since))
+        print(f"Only files modified since {since}")
     print(
         f"\n{Colors.YELLOW}Warning: This script will modify files and directories!{Colors.RESET}"
     )
@@ -119,76 +206,106 @@ Use --help to see this message.
         print("\nOperation cancelled.")
         return 0
 
-    print_status(f"Starting vault processing in: {args.dir}")
+    sinks = []
+    if args.events:
+        try:
+            sinks.append(EventLog(args.events))
+        except OSError as e:
+            print_error(f"Error: Could not open event log: {e}")
+            return 1
+    if args.scope is not None:
+        sinks.append(args.scope)
 
-    # Step 1: Move Resources
-    print_step(1, "Moving resources to _resources folders")
-    try:
-        move_resources(args.dir)
-        print("Done!")
-    except Exception as e:
-        print_error(f"Error during resource movement: {e}")
-        return 1
+    state = None
+    if args.incremental:
+        from syncstate import SyncState
 
-    # Step 2: Remove trailing underscores and spaces
-    print_step(2, "Removing trailing underscores and spaces from files and folders")
-    try:
-        remove_trailing_underscores(args.dir)
-        print("Done!")
-    except Exception as e:
-        print_error(f"Error during underscore cleanup: {e}")
-        return 1
+        try:
+            state = SyncState(
+                args.dir,
+                args.state_db,
+                workers=args.workers,
+                options=state_options(args),
+            )
+        except (sqlite3.Error, OSError) as e:
+            print_error(f"Error: Could not open state index: {e}")
+            for sink in sinks:
+                sink.close()
+            return 1
+        sinks.append(state)
+        print_status(f"Using state index: {state.db_path}")
 
-    # Step 3: Remove empty _resources directories
-    print_step(3, "Removing empty _resources directories")
     try:
-        removed_dirs = remove_empty_resources_dirs(args.dir)
-        print(f"Removed {len(removed_dirs)} empty _resources directories")
-    except Exception as e:
-        print_error(f"Error during empty directory cleanup: {e}")
-        return 1
+        result = run_steps(args, state, sinks)
+        if result != 0 or not args.watch:
+            return result
 
-    # Step 4: Process location data and source in YAML front matter (optional)
-    if args.strip_location or args.convert_location or args.add_source:
-        step_descriptions = []
-        if args.convert_location:
-            step_descriptions.append(
-                "adding human-readable location names (keeping coordinates)"
+        while True:
+            print(f"\nWatching {args.dir} for changes (Ctrl+C to stop)...", flush=True)
+            # Wait a full interval after every run too, so files that keep failing
+            # or keep changing never make the loop spin
+            changed = removed = None
+            while not changed and not removed:
+                time.sleep(args.watch_interval)
+                changed, removed = state.scan(args.scope)
+            print(
+                f"\nDetected {len(changed)} new or changed and {len(removed)} removed files"
             )
-        if args.strip_location:
-            step_descriptions.append("removing location data")
-        if args.add_source:
-            step_descriptions.append("adding source field")
+            result = run_steps(args, state, sinks)
+            if result != 0:
+                return result
+    except KeyboardInterrupt:
+        print("\nInterrupted.")
+        return 0
+    finally:
+        for sink in sinks:
+            sink.close()
 
-        step_title = "Processing YAML front matter: " + ", ".join(step_descriptions)
-        print_step(4, step_title)
 
-        if args.convert_location:
-            print(
-                "Note: This may take a while due to API rate limits (1 request/second)"
-            )
-            if args.debug:
-                print_status(
-                    "[DEBUG] Debug mode enabled - detailed API request logging active"
-                )
+def run_steps(args, state=None, sinks=(), step_options=None, on_step=None):
+    """
+    Run all migration steps once, returning the process exit code.
+
+    Args:
+        args: Command line options (see main)
+        state: Optional SyncState for incremental runs, committed after all steps
+        sinks: Objects with an emit(event) method receiving every event
+        step_options: Optional dictionary of step name -> keyword arguments added to
+                      the options from the step registry (e.g. a warm geolocator)
+        on_step: Optional callable (spec, counts, seconds, result, error) called after
+                 each step, where result is the value the step generator returned
+                 and error the exception that stopped the run, if any
+    """
+    print_status(f"Starting vault processing in: {args.dir}")
 
+    selected = [spec for spec in STEPS if spec.enabled(args)]
+    for number, spec in enumerate(selected, 1):
+        print_step(number, spec.heading(args))
+        start = time.perf_counter()
         try:
-            processed_files = process_location_frontmatter(
-                args.dir,
-                convert_to_location=args.convert_location,
-                strip_coordinates=args.strip_location,
-                add_source=args.add_source,
-                debug=args.debug,
-            )
-            print(f"\nProcessed {len(processed_files)} markdown files")
+            step = spec.load()
+            options = spec.options(args, state)
+            options.update((step_options or {}).get(spec.name, {}))
+            counts, result = drain(step(args.dir, **options), sinks)
+            print(spec.summary(counts))
         except Exception as e:
-            print_error(f"Error during frontmatter processing: {e}")
+            print_error(f"Error during {spec.error_label}: {e}")
+            consume([Event(ERROR, spec.name, args.dir, None, str(e))], sinks)
+            if on_step is not None:
+                on_step(spec, {}, time.perf_counter() - start, None, e)
             return 1
-    else:
+        if on_step is not None:
+            on_step(spec, counts, time.perf_counter() - start, result, None)
+
+    if not selected_transforms(args):
         print(
-            "\nNo front matter changes requested (use --strip-location, --convert-location, or --add-source)"
+            "\nNo front matter changes requested (use --strip-location, --convert-location, --add-source, or --transform)"
         )
 
+    if state is not None:
+        updated = state.commit(args.scope)
+        print(f"Updated {updated} entries in the state index")
+
     print(f"\n{Colors.GREEN}All operations completed successfully!{Colors.RESET}")
     return 0
 
@@ -0,0 +1,316 @@
+import os
+import sys
+import json
+import math
+import time
+import random
+import argparse
+import threading
+from urllib.parse import urlsplit, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_FIXTURE = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "fixtures", "nominatim_places.json"
+)
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients give up on hung requests; writing the late response then fails
+        if isinstance(sys.exc_info()[1], (BrokenPipeError, ConnectionResetError)):
+            return
+        super().handle_error(request, client_address)
+
+
+def load_places(path=DEFAULT_FIXTURE):
+    """Load the fixture dataset of places in Nominatim's reverse response format."""
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def distance_km(lat1, lon1, lat2, lon2):
+    """Great-circle distance between two coordinates in kilometers."""
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = (
+        math.sin((lat2 - lat1) / 2) ** 2
+        + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    )
+    return 6371.0 * 2 * math.asin(min(1.0, math.sqrt(a)))
+
+
+class NominatimStub:
+    """
+    Local stand-in for Nominatim's /reverse endpoint, served from a fixture dataset.
+
+    Each request returns the nearest fixture place within max_distance_km, or
+    Nominatim's "Unable to geocode" response. Latency, errors, hanging requests
+    and rate limiting can be injected to exercise the client's error handling.
+
+    Args:
+        places: List of places (see fixtures/nominatim_places.json)
+        host: Interface to listen on (default: 127.0.0.1)
+        port: Port to listen on; 0 picks a free port (default: 0)
+        latency: Seconds added to every response (default: 0)
+        jitter: Random extra latency of up to this many seconds (default: 0)
+        error_rate: Fraction of requests answered with HTTP 500 (default: 0)
+        hang_rate: Fraction of requests held for hang_seconds before answering,
+                   long enough for the client to time out (default: 0)
+        hang_seconds: How long hanging requests are held (default: 15)
+        rate_limit: Maximum requests per second before answering HTTP 429; 0 disables
+                    rate limiting (default: 0)
+        max_distance_km: Farthest distance at which a place still matches (default: 50)
+        seed: Seed for the error injection random generator (default: None)
+    """
+
+    def __init__(
+        self,
+        places=None,
+        host="127.0.0.1",
+        port=0,
+        latency=0.0,
+        jitter=0.0,
+        error_rate=0.0,
+        hang_rate=0.0,
+        hang_seconds=15.0,
+        rate_limit=0,
+        max_distance_km=50.0,
+        seed=None,
+    ):
+        self.places = places if places is not None else load_places()
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.hang_rate = hang_rate
+        self.hang_seconds = hang_seconds
+        self.rate_limit = rate_limit
+        self.max_distance_km = max_distance_km
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.window_start = 0.0
+        self.window_count = 0
+        self.stats = {
+            "requests": 0,
+            "served": 0,
+            "unable_to_geocode": 0,
+            "errors": 0,
+            "hung": 0,
+            "rate_limited": 0,
+        }
+        self.coordinates = set()
+        self.server = _Server((host, port), self._handler_class())
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        """Serve requests on a background thread."""
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def reset_stats(self):
+        with self.lock:
+            for key in self.stats:
+                self.stats[key] = 0
+            self.coordinates.clear()
+
+    def nearest(self, latitude, longitude):
+        """Return the nearest fixture place within range, or None."""
+        best = None
+        best_distance = self.max_distance_km
+        for place in self.places:
+            distance = distance_km(
+                latitude, longitude, float(place["lat"]), float(place["lon"])
+            )
+            if distance <= best_distance:
+                best = place
+                best_distance = distance
+        return best
+
+    def _decide(self, latitude, longitude):
+        """Count the request and pick the injected outcome for it."""
+        with self.lock:
+            self.stats["requests"] += 1
+            self.coordinates.add((latitude, longitude))
+            if self.rate_limit:
+                now = time.monotonic()
+                if now - self.window_start >= 1.0:
+                    self.window_start = now
+                    self.window_count = 0
+                self.window_count += 1
+                if self.window_count > self.rate_limit:
+                    self.stats["rate_limited"] += 1
+                    return "rate_limited"
+            roll = self.random.random()
+            if roll < self.error_rate:
+                self.stats["errors"] += 1
+                return "error"
+            if roll < self.error_rate + self.hang_rate:
+                self.stats["hung"] += 1
+                return "hang"
+            return "ok"
+
+    def _handler_class(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def _send_json(self, status, payload):
+                body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                url = urlsplit(self.path)
+                if url.path == "/status":
+                    with stub.lock:
+                        stats = dict(stub.stats)
+                        stats["unique_coordinates"] = len(stub.coordinates)
+                    self._send_json(200, stats)
+                    return
+                if url.path.rstrip("/") != "/reverse":
+                    self._send_json(404, {"error": "Not found"})
+                    return
+
+                query = parse_qs(url.query)
+                try:
+                    latitude = float(query["lat"][0])
+                    longitude = float(query["lon"][0])
+                except (KeyError, ValueError):
+                    self._send_json(400, {"error": "Parameter lat/lon missing"})
+                    return
+
+                outcome = stub._decide(latitude, longitude)
+                if outcome == "rate_limited":
+                    self.send_response(429)
+                    self.send_header("Retry-After", "1")
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+
+                delay = stub.latency
+                if stub.jitter:
+                    delay += stub.random.uniform(0, stub.jitter)
+                if outcome == "hang":
+                    delay = max(delay, stub.hang_seconds)
+                if delay > 0:
+                    time.sleep(delay)
+
+                if outcome == "error":
+                    self._send_json(500, {"error": "Internal Server Error"})
+                    return
+
+                place = stub.nearest(latitude, longitude)
+                if place is None:
+                    with stub.lock:
+                        stub.stats["unable_to_geocode"] += 1
+                    self._send_json(200, {"error": "Unable to geocode"})
+                    return
+
+                with stub.lock:
+                    stub.stats["served"] += 1
+                response = dict(place)
+                response.setdefault("licence", "Fixture data for local testing")
+                response.setdefault("osm_type", "node")
+                response.setdefault(
+                    "boundingbox",
+                    [place["lat"], place["lat"], place["lon"], place["lon"]],
+                )
+                self._send_json(200, response)
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Serve a local stand-in for Nominatim's reverse geocoding API.",
+        epilog="Point the migration tool at it with: main.py --convert-location --nominatim-url http://127.0.0.1:PORT --geocode-delay 0",
+    )
+    parser.add_argument("--host", default="127.0.0.1", help="Interface to listen on")
+    parser.add_argument(
+        "--port", type=int, default=8088, help="Port to listen on (default: 8088)"
+    )
+    parser.add_argument(
+        "--fixture", default=DEFAULT_FIXTURE, help="JSON dataset of places to serve"
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="Seconds added to every response"
+    )
+    parser.add_argument(
+        "--jitter",
+        type=float,
+        default=0.0,
+        help="Random extra latency of up to this many seconds",
+    )
+    parser.add_argument(
+        "--error-rate",
+        type=float,
+        default=0.0,
+        help="Fraction of requests answered with HTTP 500",
+    )
+    parser.add_argument(
+        "--hang-rate",
+        type=float,
+        default=0.0,
+        help="Fraction of requests held long enough for the client to time out",
+    )
+    parser.add_argument(
+        "--hang-seconds",
+        type=float,
+        default=15.0,
+        help="How long hanging requests are held (default: 15)",
+    )
+    parser.add_argument(
+        "--rate-limit",
+        type=int,
+        default=0,
+        help="Requests per second before answering HTTP 429 (default: unlimited)",
+    )
+    parser.add_argument("--seed", type=int, help="Seed for error injection")
+    args = parser.parse_args()
+
+    stub = NominatimStub(
+        load_places(args.fixture),
+        host=args.host,
+        port=args.port,
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        hang_rate=args.hang_rate,
+        hang_seconds=args.hang_seconds,
+        rate_limit=args.rate_limit,
+        seed=args.seed,
+    )
+    print(f"Serving Nominatim stand-in on {stub.url} ({len(stub.places)} places)")
+    print(f"Statistics: {stub.url}/status")
+    try:
+        stub.server.serve_forever()
+    except KeyboardInterrupt:
+        print("\nStopped.")
+    finally:
+        stub.server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
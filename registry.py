@@ -0,0 +1,242 @@
+import importlib
+from collections import namedtuple
+from events import REMOVED, REWRITTEN
+
+# Entry point group third-party packages use to provide front matter transforms
+TRANSFORM_ENTRY_POINT_GROUP = "joplin_to_obsidian.transforms"
+
+
+def load_target(target):
+    """Import and return the object named by a 'module:attribute' string."""
+    module_name, _, attribute = target.partition(":")
+    return getattr(importlib.import_module(module_name), attribute)
+
+
+class StepSpec(
+    namedtuple(
+        "StepSpec",
+        "name description heading target enabled options summary error_label",
+    )
+):
+    """
+    Metadata for a migration step. The step function is only imported when run.
+
+    Attributes:
+        name: Step name, also used in result events
+        description: Line shown in the list of operations, or None if the step
+                     is described by its selected transforms instead
+        heading: Callable (args) -> step heading
+        target: 'module:function' implementing the step
+        enabled: Callable (args) -> True if the step runs for these options
+        options: Callable (args, state) -> keyword arguments for the step function
+        summary: Callable (counts) -> line printed after the step finished
+        error_label: Used in the "Error during ..." message if the step fails
+    """
+
+    __slots__ = ()
+
+    def load(self):
+        return load_target(self.target)
+
+
+class TransformSpec(namedtuple("TransformSpec", "name description heading target")):
+    """
+    Metadata for a front matter transform applied by process_location_frontmatter.
+
+    Attributes:
+        name: Transform name as selected on the command line
+        description: Line shown in the list of operations
+        heading: Short phrase used in the front matter step heading
+        target: 'module:callable' or entry point implementing the transform; built-in
+                transforms are applied by process_location_frontmatter and use the
+                name of its keyword argument instead (e.g. 'add_source')
+    """
+
+    __slots__ = ()
+
+    @property
+    def builtin(self):
+        return isinstance(self.target, str) and ":" not in self.target
+
+    def load(self):
+        if hasattr(self.target, "load"):
+            return self.target.load()
+        return load_target(self.target)
+
+
+STEPS = []
+TRANSFORMS = {}
+
+
+def register_step(spec):
+    """Append a step to the pipeline."""
+    STEPS.append(spec)
+    return spec
+
+
+def register_transform(name, description, target, heading=None):
+    """Register a front matter transform under a name."""
+    spec = TransformSpec(name, description, heading or f"applying {name}", target)
+    TRANSFORMS[name] = spec
+    return spec
+
+
+def _transform_entry_points():
+    from importlib.metadata import entry_points
+
+    eps = entry_points()
+    if hasattr(eps, "select"):
+        return eps.select(group=TRANSFORM_ENTRY_POINT_GROUP)
+    return eps.get(TRANSFORM_ENTRY_POINT_GROUP, [])
+
+
+def get_transform(name):
+    """
+    Look up a transform by name, falling back to installed entry points.
+
+    Raises:
+        KeyError: If no transform with that name is registered or installed
+    """
+    if name not in TRANSFORMS:
+        for ep in _transform_entry_points():
+            if ep.name == name:
+                return TransformSpec(
+                    name,
+                    f"Apply '{name}' transform to YAML front matter",
+                    f"applying {name}",
+                    ep,
+                )
+        raise KeyError(name)
+    return TRANSFORMS[name]
+
+
+def available_transforms():
+    """Return the names of all registered and installed transforms."""
+    names = list(TRANSFORMS)
+    for ep in _transform_entry_points():
+        if ep.name not in names:
+            names.append(ep.name)
+    return names
+
+
+def selected_transforms(args):
+    """Return the TransformSpecs selected by the command line options, in order."""
+    selected = []
+    if args.convert_location:
+        selected.append(TRANSFORMS["convert-location"])
+    if args.strip_location:
+        selected.append(TRANSFORMS["strip-location"])
+    if args.add_source:
+        selected.append(TRANSFORMS["add-source"])
+    for name in getattr(args, "transform", None) or []:
+        selected.append(get_transform(name))
+    return selected
+
+
+def state_options(args):
+    """
+    Return the options that decide what the steps do to a note, for the fingerprint
+    an incremental SyncState records with each entry.
+    """
+    return {
+        "steps": [spec.name for spec in STEPS if spec.enabled(args)],
+        "transforms": [spec.name for spec in selected_transforms(args)],
+    }
+
+
+def _frontmatter_options(args, state):
+    options = {
+        "debug": args.debug,
+        "state": state,
+        "workers": args.workers,
+        "transforms": [],
+        "nominatim_url": args.nominatim_url,
+        "request_delay": args.geocode_delay,
+        "scope": getattr(args, "scope", None),
+    }
+    for spec in selected_transforms(args):
+        if spec.builtin:
+            options[spec.target] = True
+        else:
+            options["transforms"].append((spec.name, spec.load()))
+    return options
+
+
+register_transform(
+    "convert-location",
+    "Add human-readable location names from coordinates (keeping original coordinates)",
+    "convert_to_location",
+    heading="adding human-readable location names (keeping coordinates)",
+)
+register_transform(
+    "strip-location",
+    "Remove location data (latitude, longitude, altitude) from YAML front matter",
+    "strip_coordinates",
+    heading="removing location data",
+)
+register_transform(
+    "add-source",
+    "Add 'source: Joplin' field to YAML front matter",
+    "add_source",
+    heading="adding source field",
+)
+
+register_step(
+    StepSpec(
+        name="move_resources",
+        description="Move resources from _resources directory to _resources folders next to markdown files",
+        heading=lambda args: "Moving resources to _resources folders",
+        target="moveresources:move_resources",
+        enabled=lambda args: True,
+        options=lambda args, state: {
+            "state": state,
+            "workers": args.workers,
+            "scope": getattr(args, "scope", None),
+        },
+        summary=lambda counts: "Done!",
+        error_label="resource movement",
+    )
+)
+register_step(
+    StepSpec(
+        name="remove_trailing_underscores",
+        description="Remove trailing underscores and spaces from files and folders",
+        heading=lambda args: "Removing trailing underscores and spaces from files and folders",
+        target="cleanup:remove_trailing_underscores",
+        enabled=lambda args: True,
+        options=lambda args, state: {
+            "workers": args.workers,
+            "scope": getattr(args, "scope", None),
+        },
+        summary=lambda counts: "Done!",
+        error_label="underscore cleanup",
+    )
+)
+register_step(
+    StepSpec(
+        name="remove_empty_resources_dirs",
+        description="Remove empty _resources directories",
+        heading=lambda args: "Removing empty _resources directories",
+        target="cleanup:remove_empty_resources_dirs",
+        enabled=lambda args: True,
+        options=lambda args, state: {
+            "workers": args.workers,
+            "scope": getattr(args, "scope", None),
+        },
+        summary=lambda counts: f"Removed {counts[REMOVED]} empty _resources directories",
+        error_label="empty directory cleanup",
+    )
+)
+register_step(
+    StepSpec(
+        name="process_location_frontmatter",
+        description=None,
+        heading=lambda args: "Processing YAML front matter: "
+        + ", ".join(spec.heading for spec in selected_transforms(args)),
+        target="cleanup:process_location_frontmatter",
+        enabled=lambda args: bool(selected_transforms(args)),
+        options=_frontmatter_options,
+        summary=lambda counts: f"\nProcessed {counts[REWRITTEN]} markdown files",
+        error_label="frontmatter processing",
+    )
+)
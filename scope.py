@@ -0,0 +1,169 @@
+import os
+import fnmatch
+from datetime import datetime
+from events import RENAMED
+
+# Characters that make a path component a glob pattern
+GLOB_CHARACTERS = "*?["
+
+
+def parse_timestamp(value):
+    """
+    Parse a --changed-since value into seconds since the epoch.
+
+    Accepts seconds since the epoch or an ISO 8601 date or date and time
+    (e.g. "2024-05-01" or "2024-05-01T18:30"); values without a time zone are
+    local time.
+
+    Raises:
+        ValueError: If the value is not a valid timestamp
+    """
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    text = value.strip()
+    if text.endswith("Z"):
+        text = text[:-1] + "+00:00"
+    return datetime.fromisoformat(text).timestamp()
+
+
+class Scope:
+    """
+    Selects the part of a vault the migration steps process.
+
+    Patterns are shell globs matched case-sensitively against paths relative to the
+    vault root, with "/" as separator; "*" also matches "/". A pattern matching a
+    directory applies to everything inside it. Directories that are excluded, or
+    that cannot contain anything included, are pruned from the walk and never listed.
+
+    A Scope is also an event sink: it follows the renames of earlier steps, so
+    patterns keep matching paths by the names they had in the export.
+
+    Args:
+        root_dir: The root directory of the vault
+        include: Patterns of paths to process; everything if empty
+        exclude: Patterns of paths to leave alone, even if included
+        changed_since: Optional timestamp; files last modified before it are left
+                       alone. Directories are walked as selected by the patterns,
+                       but only renamed if a file inside them is selected.
+    """
+
+    def __init__(self, root_dir, include=(), exclude=(), changed_since=None):
+        self.root_dir = os.path.abspath(root_dir)
+        self.include = [self._normalize(pattern) for pattern in include]
+        self.exclude = [self._normalize(pattern) for pattern in exclude]
+        self.changed_since = changed_since
+        self._include_prefixes = [self._literal_prefix(p) for p in self.include]
+        self.renamed = {}
+
+    @staticmethod
+    def _normalize(pattern):
+        pattern = pattern.replace(os.sep, "/")
+        while pattern.startswith("./"):
+            pattern = pattern[2:]
+        return pattern.strip("/")
+
+    @staticmethod
+    def _literal_prefix(pattern):
+        """Return the part of a pattern before its first glob character."""
+        for index, char in enumerate(pattern):
+            if char in GLOB_CHARACTERS:
+                return pattern[:index]
+        return pattern + "/"
+
+    def emit(self, event):
+        """Event sink: remember renamed paths."""
+        if event.kind == RENAMED:
+            self.renamed[os.path.abspath(event.path)] = os.path.abspath(event.source)
+
+    def close(self):
+        pass
+
+    def _original(self, path):
+        """Map a path to the one it had before the renames seen so far."""
+        for _ in range(len(self.renamed)):
+            head, tail = path, []
+            while len(head) > len(self.root_dir) and head not in self.renamed:
+                head, name = os.path.split(head)
+                tail.append(name)
+            if head not in self.renamed:
+                break
+            path = os.path.join(self.renamed[head], *reversed(tail))
+        return path
+
+    def relative(self, path):
+        """Return the path relative to the vault root, as named in the export."""
+        rel = os.path.relpath(self._original(os.path.abspath(path)), self.root_dir)
+        return "" if rel == "." else rel.replace(os.sep, "/")
+
+    @staticmethod
+    def _matches(patterns, rel):
+        """Return True if a pattern matches the path or one of its parent directories."""
+        if not patterns:
+            return False
+        parts = rel.split("/")
+        for depth in range(1, len(parts) + 1):
+            prefix = "/".join(parts[:depth])
+            for pattern in patterns:
+                if fnmatch.fnmatchcase(prefix, pattern):
+                    return True
+        return False
+
+    def _may_contain_included(self, rel):
+        # Every match starts with its pattern's literal prefix, and every path
+        # inside the directory starts with rel + "/"
+        rel += "/"
+        for prefix in self._include_prefixes:
+            if rel.startswith(prefix) or prefix.startswith(rel):
+                return True
+        return False
+
+    def contains(self, path):
+        """Return True if the patterns select the path."""
+        rel = self.relative(path)
+        if not rel:
+            return True
+        if self._matches(self.exclude, rel):
+            return False
+        return not self.include or self._matches(self.include, rel)
+
+    def selects(self, path, st=None):
+        """
+        Return True if a file is selected by the patterns and changed_since.
+
+        Args:
+            path: Path of the file
+            st: Optional os.stat_result of the file, to avoid another stat call
+        """
+        if not self.contains(path):
+            return False
+        if self.changed_since is None:
+            return True
+        try:
+            if st is None:
+                st = os.stat(path)
+        except OSError:
+            return True
+        return st.st_mtime >= self.changed_since
+
+    def dir_filter(self, path, entry=None):
+        """Crawler dir_filter: return True if the walk should descend into a directory."""
+        rel = self.relative(path)
+        if not rel:
+            return True
+        if self._matches(self.exclude, rel):
+            return False
+        if not self.include or self._matches(self.include, rel):
+            return True
+        return self._may_contain_included(rel)
+
+
+def scope_from_args(args):
+    """Return the Scope selected by the command line options, or None for the whole vault."""
+    include = getattr(args, "include", None) or []
+    exclude = getattr(args, "exclude", None) or []
+    changed_since = getattr(args, "changed_since", None)
+    if not include and not exclude and changed_since is None:
+        return None
+    return Scope(args.dir, include, exclude, changed_since)
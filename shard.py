@@ -0,0 +1,542 @@
+import os
+import sys
+import json
+import socket
+import argparse
+import contextlib
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+from crawler import DEFAULT_WORKERS, walk
+from cleanup import remove_trailing_underscores, remove_empty_resources_dirs
+from events import Event, EventLog, ERROR, consume
+from moveresources import move_note_resources, referenced_resources
+from registry import STEPS, TRANSFORM_ENTRY_POINT_GROUP, selected_transforms
+from utils import Colors, print_error
+
+MANIFEST_NAME = "manifest.json"
+
+# Phases run shard by shard, each followed by its finalize step
+PHASES = ("move", "cleanup", "frontmatter")
+
+# Subdirectories of the work directory shared by all workers
+WORKDIR_LAYOUT = ("claims", "done", "logs", "events")
+
+
+class ShardError(Exception):
+    """Raised when a shard or finalize step cannot run yet or does not exist."""
+
+
+def _write_json(path, data):
+    tmp = f"{path}.{socket.gethostname()}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def load_manifest(workdir):
+    with open(os.path.join(workdir, MANIFEST_NAME), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _read_references(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return referenced_resources(f.read())
+
+
+def _top_only(recursive):
+    return None if recursive else (lambda path, entry: False)
+
+
+def plan(root_dir, workdir, options, workers=None):
+    """
+    Partition an export into shards and write the manifest to the work directory.
+
+    Every top-level directory is a shard, plus one non-recursive shard for the notes
+    directly in the root. Resources linked from notes in more than one shard are
+    recorded as shared; the shards leave them alone and the move finalize step
+    settles them in the order the sequential pipeline would.
+
+    Args:
+        root_dir: The root directory of the export
+        workdir: Work directory on a filesystem all workers can reach
+        options: Front matter options, named like main.py's (strip_location,
+                 convert_location, add_source, transform, nominatim_url,
+                 geocode_delay, debug)
+        workers: Number of concurrent directory listings and note reads
+                 (default: crawler.DEFAULT_WORKERS)
+
+    Returns:
+        The manifest dictionary
+    """
+    workers = workers or DEFAULT_WORKERS
+    root_dir = os.path.abspath(root_dir)
+
+    shards = {".": {"path": ".", "recursive": False, "notes": 0}}
+    with os.scandir(root_dir) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                shards[entry.name] = {"path": entry.name, "recursive": True, "notes": 0}
+
+    notes = []
+    for root, _, files in walk(root_dir, workers=workers):
+        rel_root = os.path.relpath(root, root_dir)
+        top = rel_root.split(os.sep)[0]
+        for file in files:
+            if file.endswith(".md"):
+                notes.append((os.path.join(rel_root, file), top))
+                shards[top]["notes"] += 1
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        references = list(
+            pool.map(
+                _read_references,
+                (os.path.join(root_dir, rel) for rel, _ in notes),
+            )
+        )
+
+    linked_from = {}
+    for (_, top), names in zip(notes, references):
+        for name in names:
+            linked_from.setdefault(name, set()).add(top)
+    shared = sorted(name for name, tops in linked_from.items() if len(tops) > 1)
+    shared_set = set(shared)
+
+    manifest = {
+        "root": root_dir,
+        "options": options,
+        "shards": [
+            dict(id=f"{number:04d}", **shard)
+            for number, shard in enumerate(shards.values())
+        ],
+        "shared_resources": shared,
+        "shared_notes": [
+            os.path.normpath(rel)
+            for (rel, _), names in zip(notes, references)
+            if shared_set.intersection(names)
+        ],
+    }
+
+    # A new plan starts over, so claims and done markers of earlier runs are dropped
+    for name in WORKDIR_LAYOUT:
+        os.makedirs(os.path.join(workdir, name), exist_ok=True)
+    for name in ("claims", "done"):
+        for entry in os.scandir(os.path.join(workdir, name)):
+            os.remove(entry.path)
+    _write_json(os.path.join(workdir, MANIFEST_NAME), manifest)
+    return manifest
+
+
+def _step_args(manifest, root_dir, workers):
+    """Rebuild the command line options the registry's step specs expect."""
+    options = dict(
+        strip_location=False,
+        convert_location=False,
+        add_source=False,
+        transform=[],
+        nominatim_url=None,
+        geocode_delay=1.0,
+        debug=False,
+    )
+    options.update(manifest["options"])
+    return argparse.Namespace(dir=root_dir, workers=workers, **options)
+
+
+def _frontmatter_events(path, recursive, args):
+    spec = next(spec for spec in STEPS if spec.name == "process_location_frontmatter")
+    if spec.enabled(args):
+        step = spec.load()
+        yield from step(path, recursive=recursive, **spec.options(args, None))
+
+
+def _shard_events(manifest, shard, phase, root_dir, workers):
+    path = os.path.normpath(os.path.join(root_dir, shard["path"]))
+    if phase == "move":
+        resources_dir = os.path.join(root_dir, "_resources")
+        shared = set(manifest["shared_resources"])
+        for root, _, files in walk(
+            path, workers=workers, dir_filter=_top_only(shard["recursive"])
+        ):
+            for file in files:
+                if file.endswith(".md"):
+                    yield from move_note_resources(
+                        os.path.join(root, file), resources_dir, skip=shared
+                    )
+    elif phase == "cleanup":
+        # The shard's own directory and the root's files are renamed by finalize
+        if shard["recursive"]:
+            yield from remove_trailing_underscores(path, workers=workers)
+    else:
+        # Transforms get the paths the sequential pipeline gives them
+        path = os.path.normpath(os.path.join(root_dir, shard["final_path"]))
+        yield from _frontmatter_events(
+            path, shard["recursive"], _step_args(manifest, root_dir, workers)
+        )
+
+
+def _finalize_events(manifest, phase, root_dir, workers, renamed):
+    if phase == "move":
+        resources_dir = os.path.join(root_dir, "_resources")
+        shared = set(manifest["shared_resources"])
+        for rel in manifest["shared_notes"]:
+            yield from move_note_resources(
+                os.path.join(root_dir, rel), resources_dir, only=shared
+            )
+    elif phase == "cleanup":
+        for event in remove_trailing_underscores(
+            root_dir, workers=workers, recursive=False
+        ):
+            renamed[os.path.relpath(event.source, root_dir)] = os.path.relpath(
+                event.path, root_dir
+            )
+            yield event
+        yield from remove_empty_resources_dirs(root_dir, workers=workers)
+
+
+def _run_logged(workdir, name, events):
+    """Drain events with stdout going to the work directory's log of that name."""
+    log_path = os.path.join(workdir, "logs", f"{name}.log")
+    sink = EventLog(os.path.join(workdir, "events", f"{name}.jsonl"))
+    try:
+        with open(log_path, "w", encoding="utf-8") as log:
+            with contextlib.redirect_stdout(log):
+                try:
+                    return consume(events, [sink])
+                except Exception as e:
+                    print_error(f"Error during {name}: {e}")
+                    sink.emit(Event(ERROR, name, workdir, None, str(e)))
+                    raise
+    finally:
+        sink.close()
+
+
+def _done_path(workdir, name):
+    return os.path.join(workdir, "done", name)
+
+
+def _check_ready(workdir, phase):
+    previous = PHASES[: PHASES.index(phase)]
+    for earlier in previous:
+        if not os.path.exists(_done_path(workdir, f"finalize.{earlier}")):
+            raise ShardError(f"The {earlier} phase has not been finalized yet")
+
+
+def run_shard(workdir, shard_id, phase, root_dir=None, workers=None):
+    """
+    Run one phase on one shard and mark it done.
+
+    Args:
+        workdir: Work directory written by plan()
+        shard_id: ID of the shard in the manifest
+        phase: One of PHASES
+        root_dir: Where the export is mounted on this machine (default: as planned)
+        workers: Number of concurrent directory listings (default: crawler.DEFAULT_WORKERS)
+
+    Returns:
+        Counter of event kinds
+
+    Raises:
+        ShardError: If the shard does not exist or an earlier phase is not finalized
+    """
+    manifest = load_manifest(workdir)
+    _check_ready(workdir, phase)
+    shard = next((s for s in manifest["shards"] if s["id"] == shard_id), None)
+    if shard is None:
+        raise ShardError(f"Unknown shard: {shard_id}")
+
+    root_dir = root_dir or manifest["root"]
+    name = f"{shard_id}.{phase}"
+    counts = _run_logged(
+        workdir, name, _shard_events(manifest, shard, phase, root_dir, workers)
+    )
+    _write_json(_done_path(workdir, name), dict(counts))
+    return counts
+
+
+def claim(workdir, shard_id, phase):
+    """
+    Atomically claim a shard's phase for this process.
+
+    Returns:
+        True if this process got the claim, False if another worker holds it
+    """
+    path = os.path.join(workdir, "claims", f"{shard_id}.{phase}")
+    try:
+        fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        return False
+    with os.fdopen(fd, "w") as f:
+        f.write(f"{socket.gethostname()} {os.getpid()}\n")
+    return True
+
+
+def run_worker(workdir, phase, root_dir=None, workers=None):
+    """
+    Claim and run unclaimed shards of a phase until none are left.
+
+    Largest shards are claimed first, so the last shards to finish are small ones.
+    A failed shard's claim is released so that it can be retried.
+
+    Returns:
+        Tuple of the shard IDs completed and the shard IDs that failed
+    """
+    manifest = load_manifest(workdir)
+    _check_ready(workdir, phase)
+    completed, failed = [], []
+    for shard in sorted(manifest["shards"], key=lambda s: -s["notes"]):
+        if not claim(workdir, shard["id"], phase):
+            continue
+        try:
+            run_shard(workdir, shard["id"], phase, root_dir, workers)
+            completed.append(shard["id"])
+        except Exception as e:
+            print_error(f"Shard {shard['id']} ({shard['path']}) failed: {e}")
+            os.remove(os.path.join(workdir, "claims", f"{shard['id']}.{phase}"))
+            failed.append(shard["id"])
+    return completed, failed
+
+
+def finalize(workdir, phase, root_dir=None, workers=None):
+    """
+    Run a phase's finalize step once every shard has completed the phase.
+
+    After "move", the shared resources are moved next to the first note linking them.
+    After "cleanup", the root's files and the shard directories themselves are renamed,
+    empty _resources directories are removed and the shards' final paths are recorded
+    in the manifest for the "frontmatter" phase. That phase has nothing to finalize.
+
+    Returns:
+        Counter of event kinds
+
+    Raises:
+        ShardError: If shards of the phase are not done yet
+    """
+    manifest = load_manifest(workdir)
+    _check_ready(workdir, phase)
+    pending = [
+        shard["id"]
+        for shard in manifest["shards"]
+        if not os.path.exists(_done_path(workdir, f"{shard['id']}.{phase}"))
+    ]
+    if pending:
+        raise ShardError(
+            f"{len(pending)} shards have not completed the {phase} phase: {', '.join(pending)}"
+        )
+
+    root_dir = root_dir or manifest["root"]
+    name = f"finalize.{phase}"
+    renamed = {}
+    counts = _run_logged(
+        workdir, name, _finalize_events(manifest, phase, root_dir, workers, renamed)
+    )
+    if phase == "cleanup":
+        for shard in manifest["shards"]:
+            shard["final_path"] = renamed.get(shard["path"], shard["path"])
+        _write_json(os.path.join(workdir, MANIFEST_NAME), manifest)
+    _write_json(_done_path(workdir, name), dict(counts))
+    return counts
+
+
+def _worker_process(task):
+    return run_worker(*task)
+
+
+def run_local(root_dir, workdir, options, processes=None, workers=None):
+    """
+    Plan, run every phase with a pool of worker processes and finalize, on one machine.
+
+    Workers on other machines can join with run_worker() while a phase is running.
+
+    Returns:
+        List of the shard IDs that failed; empty if the migration completed
+    """
+    processes = processes or os.cpu_count() or 1
+    plan(root_dir, workdir, options, workers)
+    for phase in PHASES:
+        task = (workdir, phase, root_dir, workers)
+        if processes == 1:
+            results = [run_worker(*task)]
+        else:
+            with multiprocessing.Pool(processes) as pool:
+                results = pool.map(_worker_process, [task] * processes)
+        failed = [shard_id for _, shard_failed in results for shard_id in shard_failed]
+        if failed:
+            return failed
+        finalize(workdir, phase, root_dir, workers)
+    return []
+
+
+def _add_root_arguments(parser):
+    parser.add_argument(
+        "--workdir",
+        required=True,
+        help="Work directory holding the manifest, claims and logs, on a filesystem all workers can reach",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=DEFAULT_WORKERS,
+        help=f"Number of concurrent directory listings per process (default: {DEFAULT_WORKERS})",
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run the migration sharded by top-level notebook across processes or machines.",
+        epilog="""
+Sharing a work directory over a network filesystem:
+  shard.py plan --dir EXPORT --workdir WORK [front matter options]
+  shard.py run --workdir WORK --phase move        (on every machine)
+  shard.py finalize --workdir WORK --phase move   (once)
+  shard.py run --workdir WORK --phase cleanup     (on every machine)
+  shard.py finalize --workdir WORK --phase cleanup
+  shard.py run --workdir WORK --phase frontmatter (on every machine)
+  shard.py finalize --workdir WORK --phase frontmatter
+
+Or on one machine:
+  shard.py local --dir EXPORT --workdir WORK --processes 8 [front matter options]
+        """,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    for name, help_text in (
+        ("plan", "Partition an export into shards and write the manifest"),
+        ("local", "Plan and run all phases with worker processes on this machine"),
+    ):
+        command = commands.add_parser(name, help=help_text)
+        command.add_argument(
+            "--dir", default=os.getcwd(), help="The root directory of the export"
+        )
+        _add_root_arguments(command)
+        command.add_argument("--strip-location", action="store_true")
+        command.add_argument("--convert-location", action="store_true")
+        command.add_argument("--nominatim-url", metavar="URL")
+        command.add_argument(
+            "--geocode-delay", type=float, default=1.0, metavar="SECONDS"
+        )
+        command.add_argument("--debug", action="store_true")
+        command.add_argument("--add-source", action="store_true")
+        command.add_argument(
+            "--transform",
+            action="append",
+            default=[],
+            metavar="NAME",
+            help=f"Front matter transform registered under '{TRANSFORM_ENTRY_POINT_GROUP}' (can be repeated)",
+        )
+    commands.choices["local"].add_argument(
+        "--processes",
+        type=int,
+        default=os.cpu_count(),
+        help="Number of worker processes (default: number of CPUs)",
+    )
+
+    for name, help_text in (
+        ("run", "Claim and run shards of a phase until none are left"),
+        ("finalize", "Finalize a phase once all its shards are done"),
+    ):
+        command = commands.add_parser(name, help=help_text)
+        _add_root_arguments(command)
+        command.add_argument("--phase", choices=PHASES, required=True)
+        command.add_argument(
+            "--dir",
+            help="Where the export is mounted on this machine (default: the planned path)",
+        )
+        if name == "run":
+            command.add_argument(
+                "--shard",
+                metavar="ID",
+                help="Run only this shard, even if it was already claimed (e.g. to retry it)",
+            )
+    args = parser.parse_args()
+
+    try:
+        if args.command in ("plan", "local"):
+            return _plan_command(args)
+        if args.command == "run":
+            if args.shard:
+                run_shard(args.workdir, args.shard, args.phase, args.dir, args.workers)
+                completed, failed = [args.shard], []
+            else:
+                completed, failed = run_worker(
+                    args.workdir, args.phase, args.dir, args.workers
+                )
+            print(f"Completed {len(completed)} shards of the {args.phase} phase")
+            return 1 if failed else 0
+        counts = finalize(args.workdir, args.phase, args.dir, args.workers)
+        print(
+            f"{Colors.GREEN}Finalized the {args.phase} phase ({sum(counts.values())} operations){Colors.RESET}"
+        )
+        return 0
+    except (ShardError, OSError) as e:
+        print_error(f"Error: {e}")
+        return 1
+
+
+def _plan_command(args):
+    if not os.path.exists(args.dir):
+        print_error(f"Error: Directory does not exist: {args.dir}")
+        return 1
+    if args.strip_location and args.convert_location:
+        print_error(
+            "Error: --strip-location and --convert-location cannot be used together"
+        )
+        return 1
+    if args.convert_location and not args.nominatim_url:
+        print_error(
+            "Error: sharded --convert-location requires --nominatim-url; parallel workers would exceed the public Nominatim usage policy"
+        )
+        return 1
+    try:
+        selected_transforms(args)
+    except KeyError as e:
+        print_error(f"Error: Unknown transform: {e.args[0]}")
+        return 1
+
+    options = {
+        key: getattr(args, key)
+        for key in (
+            "strip_location",
+            "convert_location",
+            "add_source",
+            "transform",
+            "nominatim_url",
+            "geocode_delay",
+            "debug",
+        )
+    }
+
+    if args.command == "plan":
+        manifest = plan(args.dir, args.workdir, options, args.workers)
+        print(f"Wrote {os.path.join(args.workdir, MANIFEST_NAME)}")
+        print(f"  - Shards: {len(manifest['shards'])}")
+        print(f"  - Shared resources: {len(manifest['shared_resources'])}")
+        print(f"  - Notes linking shared resources: {len(manifest['shared_notes'])}")
+        return 0
+
+    print(f"Target directory: {Colors.BLUE}{args.dir}{Colors.RESET}")
+    print(f"Work directory: {args.workdir}")
+    print(f"Worker processes: {args.processes}")
+    print(
+        f"\n{Colors.YELLOW}Warning: This script will modify files and directories!{Colors.RESET}"
+    )
+    try:
+        response = input("\nDo you want to continue? (y/N): ").strip().lower()
+        if response not in ["y", "yes"]:
+            print("Operation cancelled.")
+            return 0
+    except KeyboardInterrupt:
+        print("\nOperation cancelled.")
+        return 0
+
+    failed = run_local(args.dir, args.workdir, options, args.processes, args.workers)
+    if failed:
+        print_error(
+            f"{len(failed)} shards failed, see {os.path.join(args.workdir, 'logs')}: {', '.join(failed)}"
+        )
+        return 1
+    print(f"\n{Colors.GREEN}All operations completed successfully!{Colors.RESET}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,274 @@
+import os
+import json
+import time
+import hashlib
+import sqlite3
+from crawler import scandir_walk
+from events import ERROR, RENAMED
+
+# Default location of the state database, relative to the vault root
+STATE_DB_NAME = ".joplin-to-obsidian.db"
+
+NOTE_EXTENSIONS = (".md", ".markdown")
+
+
+def file_hash(path, chunk_size=1024 * 1024):
+    """Return the SHA-256 hex digest of a file, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def options_hash(options):
+    """Return a stable SHA-256 hex digest of a JSON-serializable options dictionary."""
+    text = json.dumps(options or {}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def classify(root_dir, path):
+    """Return 'note', 'resource' or None for a file in the vault."""
+    if path.lower().endswith(NOTE_EXTENSIONS):
+        return "note"
+    rel_parts = os.path.relpath(path, root_dir).split(os.sep)
+    if "_resources" in rel_parts[:-1]:
+        return "resource"
+    return None
+
+
+class SyncState:
+    """
+    Persisted index of the notes and resources in a vault.
+
+    Each tracked file is stored with its size, mtime and content hash as they were
+    at the end of the last completed run, together with a log of what each step
+    did to it. Reruns use the index to skip notes that have not changed since.
+
+    Entries also record a fingerprint of the options they were processed with, so a
+    run with different options processes every note again. Files that produced an
+    error event during a run are recorded as failed, so the next run retries them,
+    while scan() only reports them once the file itself changes.
+
+    Args:
+        root_dir: The root directory of the vault
+        db_path: Path of the state database (default: STATE_DB_NAME in root_dir)
+        workers: Number of concurrent directory listings (default: crawler.DEFAULT_WORKERS)
+        options: Dictionary of the options that decide what the steps do to a file
+                 (see registry.state_options)
+    """
+
+    def __init__(self, root_dir, db_path=None, workers=None, options=None):
+        self.root_dir = os.path.abspath(root_dir)
+        self.workers = workers
+        self.options_hash = options_hash(options)
+        self.failed = set()
+        self.db_path = db_path or os.path.join(self.root_dir, STATE_DB_NAME)
+        self.conn = sqlite3.connect(self.db_path)
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS files (
+                path TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                hash TEXT NOT NULL,
+                updated_at REAL NOT NULL,
+                options TEXT,
+                failed INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE TABLE IF NOT EXISTS actions (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                path TEXT NOT NULL,
+                step TEXT NOT NULL,
+                action TEXT NOT NULL,
+                detail TEXT,
+                created_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS actions_path ON actions (path);
+            """)
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(files)")]
+        if "options" not in columns:
+            # Indexes written before options were recorded match no fingerprint
+            self.conn.execute("ALTER TABLE files ADD COLUMN options TEXT")
+        if "failed" not in columns:
+            self.conn.execute(
+                "ALTER TABLE files ADD COLUMN failed INTEGER NOT NULL DEFAULT 0"
+            )
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def _key(self, path):
+        return os.path.relpath(os.path.abspath(path), self.root_dir)
+
+    def _lookup(self, path):
+        return self.conn.execute(
+            "SELECT size, mtime_ns, hash, options, failed FROM files WHERE path = ?",
+            (self._key(path),),
+        ).fetchone()
+
+    def _differs(self, path, row, st=None):
+        if row is None or row[3] != self.options_hash:
+            return True
+        try:
+            if st is None:
+                st = os.stat(path)
+        except OSError:
+            return True
+        size, mtime_ns, digest, _, _ = row
+        if st.st_size != size:
+            return True
+        if st.st_mtime_ns == mtime_ns:
+            return False
+        # Same size but touched: only the content hash can tell
+        return file_hash(path) != digest
+
+    def is_changed(self, path, st=None):
+        """
+        Return True if the file is new, differs from its recorded state, was
+        recorded with different options or failed in the last run.
+        """
+        row = self._lookup(path)
+        return row is None or bool(row[4]) or self._differs(path, row, st)
+
+    def record_action(self, path, step, action, detail=None):
+        """Log what a step did to a file."""
+        self.conn.execute(
+            "INSERT INTO actions (path, step, action, detail, created_at) VALUES (?, ?, ?, ?, ?)",
+            (self._key(path), step, action, detail, time.time()),
+        )
+
+    def emit(self, event):
+        """
+        Event sink: log every successful step operation in the action table and
+        remember the paths of errors, following later renames.
+        """
+        if event.kind == ERROR:
+            self.failed.add(self._key(event.path))
+            if event.source:
+                self.failed.add(self._key(event.source))
+            return
+        self.record_action(event.path, event.step, event.kind, event.source)
+        if event.kind == RENAMED and self.failed:
+            source, target = self._key(event.source), self._key(event.path)
+            for key in list(self.failed):
+                if key == source or key.startswith(source + os.sep):
+                    self.failed.discard(key)
+                    self.failed.add(target + key[len(source) :])
+
+    def _is_failed(self, key):
+        """Return True if the file or one of its directories produced an error in this run."""
+        for failed in self.failed:
+            if failed == os.curdir or key == failed or key.startswith(failed + os.sep):
+                return True
+        return False
+
+    def _walk(self, scope=None):
+        # Stat data is prefetched by the crawler workers and reused from the DirEntry
+        return scandir_walk(
+            self.root_dir,
+            workers=self.workers,
+            stat=True,
+            dir_filter=scope.dir_filter if scope is not None else None,
+        )
+
+    def _in_scope(self, key, scope):
+        return scope is None or scope.contains(os.path.join(self.root_dir, key))
+
+    def scan(self, scope=None):
+        """
+        Compare the vault against the index without modifying it.
+
+        With a scope.Scope, only the files it selects are compared. Files that
+        failed in the last run are only reported once they change, so a note that
+        keeps failing does not trigger a new run on every check.
+
+        Returns:
+            Tuple of (changed, removed) lists of paths relative to the vault root
+        """
+        changed = []
+        seen = set()
+        for _, _, entries in self._walk(scope):
+            for entry in entries:
+                path = entry.path
+                if classify(self.root_dir, path) is None:
+                    continue
+                seen.add(self._key(path))
+                try:
+                    st = entry.stat()
+                except OSError:
+                    st = None
+                if scope is not None and not scope.selects(path, st):
+                    continue
+                if self._differs(path, self._lookup(path), st):
+                    changed.append(self._key(path))
+        known = [row[0] for row in self.conn.execute("SELECT path FROM files")]
+        removed = [
+            path for path in known if path not in seen and self._in_scope(path, scope)
+        ]
+        return changed, removed
+
+    def commit(self, scope=None):
+        """
+        Record the current state of every note and resource in the vault.
+
+        Files whose size, mtime and options match the index are not re-hashed, and
+        entries for files that no longer exist are dropped. Files that produced an
+        error event since the last commit are recorded as failed, so the next run
+        processes them again. With a scope.Scope, only the files it selects are recorded and
+        entries outside it are kept as they are.
+
+        Returns:
+            Number of entries that were added or updated
+        """
+        updated = 0
+        seen = set()
+        now = time.time()
+        for _, _, entries in self._walk(scope):
+            for entry in entries:
+                path = entry.path
+                kind = classify(self.root_dir, path)
+                if kind is None:
+                    continue
+                key = self._key(path)
+                seen.add(key)
+                failed = 1 if self.failed and self._is_failed(key) else 0
+                try:
+                    st = entry.stat()
+                    if scope is not None and not scope.selects(path, st):
+                        continue
+                    row = self._lookup(path)
+                    if (
+                        row is not None
+                        and row[0] == st.st_size
+                        and row[1] == st.st_mtime_ns
+                        and row[3] == self.options_hash
+                        and row[4] == failed
+                    ):
+                        continue
+                    digest = file_hash(path)
+                except OSError:
+                    continue
+                self.conn.execute(
+                    "INSERT OR REPLACE INTO files (path, kind, size, mtime_ns, hash, updated_at, options, failed) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        key,
+                        kind,
+                        st.st_size,
+                        st.st_mtime_ns,
+                        digest,
+                        now,
+                        self.options_hash,
+                        failed,
+                    ),
+                )
+                updated += 1
+
+        known = [row[0] for row in self.conn.execute("SELECT path FROM files")]
+        for key in known:
+            if key not in seen and self._in_scope(key, scope):
+                self.conn.execute("DELETE FROM files WHERE path = ?", (key,))
+        self.conn.commit()
+        self.failed.clear()
+        return updated